@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'transit.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -89,6 +91,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Web workers, the ingest_realtime daemon and the import commands coordinate
+# through this cache: the shared GTFS-RT snapshot and its refresh lock,
+# network document invalidation, arrival and departure boards, and stored
+# request profiles. It must be shared by every process, so a per-process
+# backend such as LocMemCache will not do, even in development.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -140,4 +158,75 @@ GEOS_LIBRARY_PATH = '/opt/homebrew/opt/geos/lib/libgeos_c.dylib'
 
 # GTFS-RT Settings
 GTFS_RT_URL = 'http://20.19.98.194:8328/Api/api/gtfs-realtime'
-GTFS_RT_TIMEOUT = 3  # seconds
\ No newline at end of file
+GTFS_RT_TIMEOUT = 3  # seconds
+GTFS_RT_REFRESH_INTERVAL = 15  # seconds between upstream fetches
+GTFS_RT_STALE_TTL = 300  # seconds the last good snapshot may be served
+GTFS_RT_DELTA_WINDOW = 120  # seconds of past versions available to ?since= deltas
+GTFS_RT_MAX_BACKOFF = 120  # seconds, upper bound between failed polls
+
+# Realtime push (Server-Sent Events, served by config.asgi only)
+REALTIME_PUSH_CHECK_INTERVAL = 1  # seconds between checks for a new snapshot
+REALTIME_STREAM_KEEPALIVE = 20  # seconds of silence before a keepalive comment
+REALTIME_STREAM_MAX_AGE = 300  # seconds before a stream is closed for the client to reconnect
+
+# Vehicle position history (see transit.history and prune_position_history)
+POSITION_HISTORY_RETENTION_DAYS = 30
+POSITION_HISTORY_DOWNSAMPLE_AFTER_DAYS = 2
+POSITION_HISTORY_DOWNSAMPLE_SECONDS = 60
+
+# Route geometry simplification levels in degrees (~10 m, ~50 m, ~200 m)
+ROUTE_SIMPLIFY_TOLERANCES = [0.0001, 0.0005, 0.002]
+
+# Vector tiles
+TILE_STOPS_MIN_ZOOM = 12  # stops layer is omitted from lower-zoom tiles
+TILE_CACHE_TIMEOUT = 86400  # seconds; tiles are also dropped on re-import
+
+# Lifetime of other prebuilt network documents (routes.geojson); invalidation
+# supersedes them at once, this only evicts the stale versions
+NETWORK_DOCUMENT_TIMEOUT = 86400  # seconds
+
+# stops.json paging
+STOPS_MAX_LIMIT = 1000
+
+# Nearby stops lookup
+NEARBY_STOPS_DEFAULT_K = 10
+NEARBY_STOPS_MAX_K = 50
+NEARBY_STOPS_DEFAULT_RADIUS = 500  # metres
+NEARBY_STOPS_MAX_RADIUS = 5000  # metres
+
+# Arrival estimates (see transit.eta)
+ETA_HORIZON = 3600  # seconds ahead to estimate arrivals for
+ETA_MAX_PER_STOP = 20
+ETA_DEFAULT_SPEED = 5.0  # m/s, used until a vehicle's speed has been observed
+ETA_MIN_SPEED = 1.0  # m/s, keeps stationary vehicles from producing unbounded estimates
+
+# Map matching of vehicle positions (see transit.map_matching)
+MAP_MATCH_MAX_DISTANCE = 200  # metres; vehicles further from their route are left unmatched
+MAP_MATCH_STOPPED_DISTANCE = 20  # metres from a stop to count as STOPPED_AT
+MAP_MATCH_INCOMING_DISTANCE = 150  # metres before the next stop to count as INCOMING_AT
+
+# Realtime departures boards (see transit.departures)
+DEPARTURES_DEFAULT_LIMIT = 10
+DEPARTURES_MAX_LIMIT = 50
+
+# Static schedule (see transit.gtfs_static and transit.schedule_index)
+GTFS_TIMEZONE = 'Europe/Nicosia'  # agency_timezone; service days start at local midnight
+SCHEDULE_INDEX_PATH = BASE_DIR / 'data' / 'schedule_index.npz'
+SCHEDULE_DEFAULT_LIMIT = 10
+SCHEDULE_MAX_LIMIT = 50
+
+# Prometheus metrics (see transit.metrics); every process records into
+# prometheus_client's multiprocess directory, emptied before each restart
+METRICS_DIR = BASE_DIR / 'data' / 'metrics'
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', str(METRICS_DIR))
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # scrapers allowed without a token
+METRICS_TOKEN = None  # bearer token accepted from other addresses
+
+# Request profiling (see transit.profiling); browse at /admin/profiles/
+PROFILING_SAMPLE_RATE = 0.0  # fraction of requests profiled without a token
+PROFILING_HEADER = 'X-Profile'  # carries a token from manage.py profiling_token
+PROFILING_TOKEN_MAX_AGE = 86400  # seconds a token stays valid
+PROFILING_MAX_PROFILES = 20  # profiles kept; the oldest is overwritten
+
+# Response build time allowed per read endpoint in transit.tests
+RESPONSE_BUDGET_MS = 1000
\ No newline at end of file
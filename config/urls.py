@@ -3,8 +3,13 @@ URL configuration for config project.
 """
 from django.contrib import admin
 from django.urls import path, include
+from transit.views import profile_detail, profile_download, profile_list
 
 urlpatterns = [
+    # Ahead of the admin site, whose catch-all would otherwise claim them
+    path('admin/profiles/', profile_list, name='admin-profiles'),
+    path('admin/profiles/<int:profile_id>/', profile_detail, name='admin-profile'),
+    path('admin/profiles/<int:profile_id>/download/', profile_download, name='admin-profile-download'),
     path('admin/', admin.site.urls),
     path('', include('transit.urls', namespace='transit')),
 ]
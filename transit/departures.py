@@ -0,0 +1,85 @@
+"""
+Predicted departures from GTFS-RT TripUpdates.
+
+TripUpdate entities arrive in the same feed as vehicle positions and are
+decoded in the same pass. Predictions are indexed per stop into a list sorted
+by time and cached, so a departures board is one cache read plus a bisect,
+without touching the database or the feed on the request path.
+"""
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from google.transit import gtfs_realtime_pb2
+
+STOP_IDS_KEY = 'departures:stops'
+
+SKIPPED = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SKIPPED
+
+
+def stop_key(stop_id):
+    return f'departures:stop:{stop_id}'
+
+
+def departures_from_feed(feed):
+    """Predicted departures per stop_id, sorted by time"""
+    by_stop = {}
+    for entity in feed.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        update = entity.trip_update
+        for stop_time in update.stop_time_update:
+            if stop_time.schedule_relationship == SKIPPED or not stop_time.stop_id:
+                continue
+            # Boards show departures; the last stop of a trip only has an arrival
+            event = stop_time.departure if stop_time.departure.time else stop_time.arrival
+            if not event.time:
+                continue
+            by_stop.setdefault(stop_time.stop_id, []).append({
+                'time': event.time,
+                'delay': event.delay if event.HasField('delay') else None,
+                'route_id': update.trip.route_id,
+                'trip_id': update.trip.trip_id,
+                'vehicle_id': update.vehicle.id or None,
+                'stop_sequence': stop_time.stop_sequence if stop_time.HasField('stop_sequence') else None,
+            })
+
+    for departures in by_stop.values():
+        departures.sort(key=lambda departure: departure['time'])
+    return by_stop
+
+
+def publish(feed, generated_at=None):
+    """Cache the departures board of every stop in `feed`; returns boards published"""
+    generated_at = generated_at or time.time()
+    by_stop = departures_from_feed(feed)
+    timeout = settings.GTFS_RT_STALE_TTL
+    cache.set_many({
+        stop_key(stop_id): {
+            'generated_at': generated_at,
+            'times': [departure['time'] for departure in departures],
+            'departures': departures,
+        }
+        for stop_id, departures in by_stop.items()
+    }, timeout=timeout)
+
+    previous_ids = cache.get(STOP_IDS_KEY) or set()
+    emptied = previous_ids - by_stop.keys()
+    if emptied:
+        cache.delete_many([stop_key(stop_id) for stop_id in emptied])
+    cache.set(STOP_IDS_KEY, set(by_stop), timeout=timeout)
+    return len(by_stop)
+
+
+def next_departures(stop_id, after, limit):
+    """Up to `limit` departures at or after `after` (epoch seconds), and the board's age.
+
+    Returns (departures, generated_at); generated_at is None when no board
+    has been published for the stop.
+    """
+    board = cache.get(stop_key(stop_id))
+    if board is None:
+        return [], None
+    start = bisect_left(board['times'], after)
+    return board['departures'][start:start + limit], board['generated_at']
@@ -0,0 +1,133 @@
+"""
+Arrival time estimates from realtime vehicle positions.
+
+Each snapshot, vehicles are map matched onto their route geometry (see
+transit.map_matching), their speed along the route is estimated from
+consecutive matches, and arrival times at the stops ahead follow from each
+stop's precomputed distance along the route. The results are cached
+per stop code for the arrivals board, so serving a board is a single cache
+read. Estimates are produced by the ingest_realtime daemon.
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .linear_referencing import route_network
+
+STOP_CODES_KEY = 'eta:stops'
+
+# Weight of the newest observation in the smoothed speed
+SPEED_SMOOTHING = 0.3
+
+# vehicle_id -> (trip_id, distance along, fix timestamp, smoothed speed)
+_previous = {}
+
+
+def stop_key(code):
+    return f'eta:stop:{code}'
+
+
+def _estimate_speed(vehicle, along, timestamp):
+    """Smoothed speed along the route in m/s, or None if nothing is known yet"""
+    previous = _previous.get(vehicle.vehicle_id)
+    if previous is not None and previous[0] == vehicle.trip_id:
+        _, previous_along, previous_timestamp, previous_speed = previous
+        elapsed = timestamp - previous_timestamp
+        if elapsed <= 0:
+            return previous_speed
+        observed = (along - previous_along) / elapsed
+        if observed < 0:
+            # GPS jitter backwards along the route; keep the last estimate
+            return previous_speed
+        if previous_speed is None:
+            return observed
+        return SPEED_SMOOTHING * observed + (1 - SPEED_SMOOTHING) * previous_speed
+    return vehicle.speed or None
+
+
+def estimate_arrivals(positions, now=None):
+    """Estimate arrivals at every stop ahead of each vehicle.
+
+    `positions` are map-matched RealtimeVehicles from
+    process_vehicle_positions; unmatched vehicles, and those whose route
+    has left the network since matching, are skipped. Returns
+    {stop code: [arrival, ...]} sorted by arrival time.
+    """
+    global _previous
+    now = now or time.time()
+    network = route_network()
+
+    vehicles = [vehicle for vehicle in positions if getattr(vehicle, 'distance_along', None) is not None]
+    rows = network.rows_for([vehicle.route_id for vehicle in vehicles])
+    # The network may have been reloaded since matching; a route that has
+    # gone would index the last row with -1, so its vehicles are dropped
+    known = rows >= 0
+    vehicles = [vehicle for vehicle, is_known in zip(vehicles, known) if is_known]
+    rows = rows[known]
+    if not vehicles:
+        _previous = {}
+        return {}
+
+    along = np.array([vehicle.distance_along for vehicle in vehicles])
+    timestamps = np.array([vehicle.timestamp.timestamp() for vehicle in vehicles])
+    speeds = np.empty(len(vehicles))
+    seen = {}
+    for i, vehicle in enumerate(vehicles):
+        speed = _estimate_speed(vehicle, along[i], timestamps[i])
+        seen[vehicle.vehicle_id] = (vehicle.trip_id, along[i], timestamps[i], speed)
+        speeds[i] = max(speed or settings.ETA_DEFAULT_SPEED, settings.ETA_MIN_SPEED)
+    _previous = seen
+
+    # (vehicles, stops) for the whole fleet at once; padding stops sit at
+    # infinity and fall outside the horizon
+    remaining = network.stop_distances[rows] - along[:, None]
+    arrival_times = timestamps[:, None] + remaining / speeds[:, None]
+    ahead = (remaining > 0) & (arrival_times >= now) & (arrival_times <= now + settings.ETA_HORIZON)
+
+    arrivals = {}
+    for v, s in zip(*np.nonzero(ahead)):
+        vehicle = vehicles[v]
+        arrivals.setdefault(network.stop_codes[rows[v]][s], []).append({
+            'vehicle_id': vehicle.vehicle_id,
+            'route_id': vehicle.route_id,
+            'trip_id': vehicle.trip_id,
+            'stop_sequence': int(network.stop_sequences[rows[v], s]),
+            'arrival_time': float(arrival_times[v, s]),
+            'distance': round(float(remaining[v, s])),
+        })
+
+    for stop_arrivals in arrivals.values():
+        stop_arrivals.sort(key=lambda arrival: arrival['arrival_time'])
+        del stop_arrivals[settings.ETA_MAX_PER_STOP:]
+    return arrivals
+
+
+def publish_arrivals(arrivals, generated_at=None):
+    """Cache arrivals per stop and clear boards that no longer have any"""
+    generated_at = generated_at or time.time()
+    timeout = settings.GTFS_RT_STALE_TTL
+    cache.set_many({
+        stop_key(code): {'generated_at': generated_at, 'arrivals': stop_arrivals}
+        for code, stop_arrivals in arrivals.items()
+    }, timeout=timeout)
+
+    previous_codes = cache.get(STOP_CODES_KEY) or set()
+    emptied = previous_codes - arrivals.keys()
+    if emptied:
+        cache.delete_many([stop_key(code) for code in emptied])
+    cache.set(STOP_CODES_KEY, set(arrivals), timeout=timeout)
+
+
+def update(positions):
+    """Estimate and publish arrivals for a snapshot; returns boards updated"""
+    now = time.time()
+    arrivals = estimate_arrivals(positions, now)
+    publish_arrivals(arrivals, now)
+    return len(arrivals)
+
+
+def stop_arrivals(code):
+    """Cached arrivals for a stop, or None if no estimate has been published"""
+    return cache.get(stop_key(code))
@@ -0,0 +1,245 @@
+"""
+Shared GTFS-RT snapshot cache.
+
+Views read decoded vehicle snapshots from Django's cache instead of calling
+the upstream feed themselves. The feed is fetched at most once per
+GTFS_RT_REFRESH_INTERVAL across all workers sharing the cache backend,
+concurrent misses coalesce into a single upstream call, and the last good
+snapshot keeps being served while the upstream is slow or down.
+
+Every stored snapshot gets a monotonically increasing version, and recent
+versions are kept for GTFS_RT_DELTA_WINDOW seconds so clients can ask for
+just the vehicles that changed since the version they already have.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import departures
+from .services import fetch_feed_content, parse_feed, serialize_vehicle_positions
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'gtfs_rt:snapshot'
+REFRESH_LOCK_KEY = 'gtfs_rt:refresh-lock'
+REFRESH_ERROR_KEY = 'gtfs_rt:refresh-error'
+VERSION_KEY = 'gtfs_rt:version'
+
+# Vehicle fields whose change makes a vehicle part of a delta
+DELTA_FIELDS = ('lat', 'lon', 'matched_lat', 'matched_lon', 'bearing', 'speed', 'route', 'current_stop_sequence', 'current_status')
+
+
+class _Flight:
+    """A refresh in progress in this worker, awaited by concurrent callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.snapshot = None
+        self.error = None
+
+
+# Coalesces refreshes between threads of one worker; REFRESH_LOCK_KEY does the
+# same between workers.
+_flight_lock = threading.Lock()
+_flight = {'current': None}
+
+
+def build_snapshot(content, fetched_at=None):
+    """Decode raw feed bytes into a cacheable snapshot"""
+    return snapshot_from_feed(parse_feed(content), fetched_at, content)
+
+
+def snapshot_from_feed(feed, fetched_at=None, content=None, positions=None):
+    """Build a cacheable snapshot from an already decoded FeedMessage.
+
+    The raw feed bytes are kept for clients that want the protobuf itself
+    (see transit.wire_formats). `positions` are the feed's map-matched
+    vehicles, when already computed.
+    """
+    fetched_at = fetched_at or time.time()
+    updated = datetime.fromtimestamp(fetched_at, tz=dt_timezone.utc).isoformat()
+    return {
+        'fetched_at': fetched_at,
+        'feed_timestamp': feed.header.timestamp,
+        'vehicles': serialize_vehicle_positions(feed, updated=updated, positions=positions),
+        'content': content if content is not None else feed.SerializeToString(),
+    }
+
+
+def store_snapshot(snapshot):
+    """Version a snapshot and publish it to every worker sharing the cache"""
+    snapshot['version'] = _next_version()
+    cache.set_many({
+        SNAPSHOT_KEY: snapshot,
+        _version_key(snapshot['version']): snapshot,
+    }, timeout=max(settings.GTFS_RT_STALE_TTL, settings.GTFS_RT_DELTA_WINDOW))
+
+
+def _next_version():
+    # Seeded from the clock so versions keep increasing if the counter is
+    # evicted or the cache restarts.
+    cache.add(VERSION_KEY, int(time.time()), timeout=None)
+    return cache.incr(VERSION_KEY)
+
+
+def _version_key(version):
+    return f'gtfs_rt:snapshot:{version}'
+
+
+def _delta_state(vehicle):
+    return tuple(vehicle[field] for field in DELTA_FIELDS)
+
+
+def delta_since(snapshot, since):
+    """Vehicles added, moved or removed between version `since` and `snapshot`.
+
+    Returns None when `since` is unknown or older than the delta window, in
+    which case the caller should send the full snapshot.
+    """
+    version = snapshot['version']
+    if since == version:
+        return {'vehicles': [], 'removed': []}
+    if since > version:
+        return None
+
+    key = f'gtfs_rt:delta:{since}:{version}'
+    delta = cache.get(key)
+    if delta is not None:
+        return delta
+
+    previous = cache.get(_version_key(since))
+    if previous is None or time.time() - previous['fetched_at'] > settings.GTFS_RT_DELTA_WINDOW:
+        return None
+
+    previous_state = {v['vehicle_id']: _delta_state(v) for v in previous['vehicles']}
+    delta = {
+        'vehicles': [
+            v for v in snapshot['vehicles']
+            if previous_state.get(v['vehicle_id']) != _delta_state(v)
+        ],
+        'removed': sorted(
+            previous_state.keys() - {v['vehicle_id'] for v in snapshot['vehicles']}
+        ),
+    }
+    # Clients poll in lockstep, so most of them ask for the same delta
+    cache.set(key, delta, timeout=settings.GTFS_RT_REFRESH_INTERVAL * 2)
+    return delta
+
+
+def is_fresh(snapshot):
+    return time.time() - snapshot['fetched_at'] < settings.GTFS_RT_REFRESH_INTERVAL
+
+
+def expires_at(snapshot):
+    """When clients should poll again for a newer snapshot"""
+    return datetime.fromtimestamp(
+        snapshot['fetched_at'] + settings.GTFS_RT_REFRESH_INTERVAL, tz=dt_timezone.utc
+    )
+
+
+def snapshot_payload(snapshot, since=None):
+    """The realtime positions document for `snapshot`, as a delta when possible"""
+    payload = {
+        'version': snapshot['version'],
+        'expires': expires_at(snapshot).isoformat()
+    }
+    delta = delta_since(snapshot, since) if since is not None else None
+    if delta is None:
+        payload.update(full=True, vehicles=snapshot['vehicles'])
+    else:
+        payload.update(full=False, since=since, **delta)
+    return payload
+
+
+def get_snapshot():
+    """Return the current snapshot, refreshing it from upstream when due"""
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and is_fresh(snapshot):
+        return snapshot
+    return _refresh(snapshot)
+
+
+def _refresh(stale):
+    """Refresh the snapshot, or join the refresh already running in this worker"""
+    with _flight_lock:
+        flight = _flight['current']
+        leader = flight is None
+        if leader:
+            flight = _flight['current'] = _Flight()
+
+    if not leader:
+        # With a stale copy on hand there is no reason to wait for the fetch
+        if stale is not None:
+            return stale
+        if not flight.done.wait(timeout=2 * (settings.GTFS_RT_TIMEOUT + 1)):
+            raise RuntimeError("GTFS-RT feed unavailable")
+        if flight.error is not None:
+            raise RuntimeError("GTFS-RT feed unavailable") from flight.error
+        return flight.snapshot
+
+    try:
+        flight.snapshot = _fetch_snapshot(stale)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flight_lock:
+            _flight['current'] = None
+        flight.done.set()
+    return flight.snapshot
+
+
+def _fetch_snapshot(stale):
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and is_fresh(snapshot):
+        return snapshot
+    stale = snapshot or stale
+
+    # cache.add only succeeds for one caller, so exactly one worker fetches
+    if not cache.add(REFRESH_LOCK_KEY, True, timeout=settings.GTFS_RT_TIMEOUT + 1):
+        return stale if stale is not None else _wait_for_snapshot()
+
+    try:
+        content = fetch_feed_content(settings.GTFS_RT_URL, timeout=settings.GTFS_RT_TIMEOUT)
+        feed = parse_feed(content)
+        snapshot = snapshot_from_feed(feed, content=content)
+        store_snapshot(snapshot)
+    except Exception as e:
+        # Hold the lock for a full interval so a failing upstream is not
+        # retried by every request that finds the snapshot stale, and tell
+        # workers waiting on this fetch that it failed.
+        cache.set_many({REFRESH_LOCK_KEY: True, REFRESH_ERROR_KEY: str(e)},
+                       timeout=settings.GTFS_RT_REFRESH_INTERVAL)
+        if stale is None:
+            raise
+        logger.warning('GTFS-RT refresh failed, serving stale snapshot', exc_info=True)
+        return stale
+
+    cache.delete_many([REFRESH_LOCK_KEY, REFRESH_ERROR_KEY])
+
+    # The snapshot is already stored, so a departures failure must not be
+    # reported to waiters as a failed fetch
+    try:
+        departures.publish(feed, snapshot['fetched_at'])
+    except Exception:
+        logger.exception('Publishing departures from the GTFS-RT snapshot failed')
+    return snapshot
+
+
+def _wait_for_snapshot():
+    """Wait for the worker holding the refresh lock to publish a snapshot"""
+    deadline = time.monotonic() + settings.GTFS_RT_TIMEOUT + 1
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot
+        error = cache.get(REFRESH_ERROR_KEY)
+        if error is not None:
+            raise RuntimeError(f"GTFS-RT feed unavailable: {error}")
+    raise RuntimeError("GTFS-RT feed unavailable")
+
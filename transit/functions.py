@@ -0,0 +1,19 @@
+"""
+Database functions for reading point coordinates in queries.
+
+Annotating ST_X/ST_Y lets endpoints project plain floats with values()
+instead of decoding every geometry into a GEOS object.
+"""
+from django.db.models import FloatField, Func
+
+
+class X(Func):
+    """Longitude of a point"""
+    function = 'ST_X'
+    output_field = FloatField()
+
+
+class Y(Func):
+    """Latitude of a point"""
+    function = 'ST_Y'
+    output_field = FloatField()
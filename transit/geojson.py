@@ -0,0 +1,83 @@
+"""
+Prebuilt GeoJSON documents for the static network.
+"""
+import json
+from collections import defaultdict
+
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import metrics, network_cache
+from .functions import X, Y
+from .models import Route, RouteStop, SimplifiedRouteGeometry
+
+
+def build_routes_geojson(tolerance=None):
+    """Build the routes FeatureCollection.
+
+    With a `tolerance`, geometries come from the matching simplified level
+    (routes without one keep their full geometry). Runs at most three
+    queries regardless of network size.
+    """
+    stops_by_route = defaultdict(list)
+    route_stops = RouteStop.objects.order_by('route_id', 'sequence').values(
+        'route_id', 'sequence', 'stop__code', 'stop__description',
+        'stop__description_en', 'stop__description_el',
+        lon=X('stop__location'), lat=Y('stop__location'),
+    )
+    for rs in route_stops:
+        stops_by_route[rs['route_id']].append({
+            'code': rs['stop__code'],
+            'description': rs['stop__description'],
+            'description_en': rs['stop__description_en'],
+            'description_el': rs['stop__description_el'],
+            'sequence': rs['sequence'],
+            'location': [rs['lon'], rs['lat']]
+        })
+
+    routes = Route.objects.annotate(geometry_json=AsGeoJSON('geometry')).values(
+        'id', 'route_id', 'name', 'description', 'line_name', 'route_name',
+        'direction', 'color', 'geometry_json',
+    )
+    simplified = {}
+    if tolerance is not None:
+        simplified = dict(
+            SimplifiedRouteGeometry.objects.filter(tolerance=tolerance)
+            .annotate(geometry_json=AsGeoJSON('geometry'))
+            .values_list('route_id', 'geometry_json')
+        )
+
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': json.loads(simplified.get(route['id'], route['geometry_json'])),
+            'properties': {
+                'route_id': route['route_id'],
+                'name': route['name'],
+                'description': route['description'],
+                'line_name': route['line_name'],
+                'route_name': route['route_name'],
+                'direction': route['direction'],
+                'color': route['color'],
+                'stops': stops_by_route[route['id']]
+            }
+        }
+        for route in routes
+    ]
+    return {
+        'type': 'FeatureCollection',
+        'features': features
+    }
+
+
+def routes_document(tolerance=None):
+    """The encoded routes FeatureCollection for the current network version"""
+    name = f'routes.geojson:{tolerance}' if tolerance is not None else 'routes.geojson'
+
+    def build():
+        collection = build_routes_geojson(tolerance)
+        with metrics.SERIALIZE_SECONDS.labels(document='routes.geojson').time():
+            content = json.dumps(collection, cls=DjangoJSONEncoder).encode()
+        return network_cache.encode_document(content)
+
+    return network_cache.get_or_build(name, build)
@@ -0,0 +1,257 @@
+"""
+Incremental loading of the GTFS static schedule.
+
+Every file is hashed and skipped when it matches the hash recorded by the
+previous import. A changed file is streamed into a temporary staging table
+with COPY, normalised into a second temporary table in SQL, and merged into
+its target table with one INSERT ... ON CONFLICT that only rewrites rows
+whose content hash differs, plus one DELETE for rows that disappeared. The
+whole import runs in a single transaction, so readers see either the old
+schedule or the new one, never a half-imported one.
+"""
+import csv
+import hashlib
+import io
+import itertools
+
+from django.db import connection, transaction
+
+from .models import Calendar, CalendarDate, FeedFile, Shape, StopTime, Trip
+
+COPY_BATCH_SIZE = 1000
+
+
+def _seconds(column):
+    """SQL for a GTFS HH:MM:SS time as seconds after midnight, NULL if empty"""
+    value = f"NULLIF(trim(s.{column}), '')"
+    return (
+        f"CASE WHEN {value} IS NULL THEN NULL ELSE "
+        f"split_part({value}, ':', 1)::int * 3600 + split_part({value}, ':', 2)::int * 60 "
+        f"+ split_part({value}, ':', 3)::int END"
+    )
+
+
+def _date(column):
+    return f"to_date(s.{column}, 'YYYYMMDD')"
+
+
+def _hash(*columns):
+    return "md5(concat_ws('|', " + ', '.join(f's.{column}' for column in columns) + "))"
+
+
+DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Files in load order. `columns` are read from the file (missing optional
+# columns load as empty strings), `select` turns the staging rows into one
+# row per `key` with the target table's columns, and files in `depends` force
+# a reload when they change.
+FILES = [
+    {
+        'name': 'calendar.txt',
+        'model': Calendar,
+        'columns': ['service_id', *DAYS, 'start_date', 'end_date'],
+        'required': ['service_id', *DAYS, 'start_date', 'end_date'],
+        'key': ['service_id'],
+        'select': (
+            "SELECT DISTINCT ON (s.service_id) s.service_id, "
+            + ', '.join(f"s.{day} = '1' AS {day}" for day in DAYS)
+            + f", {_date('start_date')} AS start_date, {_date('end_date')} AS end_date, "
+            + _hash('service_id', *DAYS, 'start_date', 'end_date') + " AS content_hash "
+            "FROM {stage} s ORDER BY s.service_id"
+        ),
+    },
+    {
+        'name': 'calendar_dates.txt',
+        'model': CalendarDate,
+        'columns': ['service_id', 'date', 'exception_type'],
+        'required': ['service_id', 'date', 'exception_type'],
+        'key': ['service_id', 'date'],
+        'select': (
+            f"SELECT DISTINCT ON (s.service_id, {_date('date')}) s.service_id, {_date('date')} AS date, "
+            f"s.exception_type::smallint AS exception_type, "
+            f"{_hash('service_id', 'date', 'exception_type')} AS content_hash "
+            "FROM {stage} s ORDER BY s.service_id, " + _date('date')
+        ),
+    },
+    {
+        'name': 'shapes.txt',
+        'model': Shape,
+        'columns': ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+        'required': ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+        'key': ['shape_id'],
+        'select': (
+            "SELECT s.shape_id, ST_SetSRID(ST_MakeLine("
+            "ST_MakePoint(s.shape_pt_lon::float, s.shape_pt_lat::float) ORDER BY s.shape_pt_sequence::int"
+            "), 4326) AS geometry, "
+            "md5(string_agg(concat_ws('|', s.shape_pt_lat, s.shape_pt_lon, s.shape_pt_sequence), ',' "
+            "ORDER BY s.shape_pt_sequence::int)) AS content_hash "
+            "FROM {stage} s GROUP BY s.shape_id HAVING count(*) >= 2"
+        ),
+    },
+    {
+        'name': 'trips.txt',
+        'model': Trip,
+        'columns': ['trip_id', 'route_id', 'service_id', 'shape_id', 'trip_headsign', 'direction_id'],
+        'required': ['trip_id', 'route_id', 'service_id'],
+        'key': ['trip_id'],
+        'select': (
+            "SELECT DISTINCT ON (s.trip_id) s.trip_id, s.route_id, s.service_id, s.shape_id, "
+            "s.trip_headsign AS headsign, NULLIF(trim(s.direction_id), '')::smallint AS direction_id, "
+            + _hash('trip_id', 'route_id', 'service_id', 'shape_id', 'trip_headsign', 'direction_id')
+            + " AS content_hash FROM {stage} s ORDER BY s.trip_id"
+        ),
+        # Stop times of removed trips go with them
+        'before_delete': (
+            f"DELETE FROM {StopTime._meta.db_table} st USING {Trip._meta.db_table} t "
+            "WHERE st.trip_id = t.id AND NOT EXISTS (SELECT 1 FROM {incoming} n WHERE n.trip_id = t.trip_id)"
+        ),
+    },
+    {
+        'name': 'stop_times.txt',
+        'model': StopTime,
+        'columns': ['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time'],
+        'required': ['trip_id', 'stop_id', 'stop_sequence'],
+        'key': ['trip_id', 'stop_sequence'],
+        'select': (
+            "SELECT DISTINCT ON (t.id, s.stop_sequence::int) t.id AS trip_id, s.stop_id, "
+            f"s.stop_sequence::int AS stop_sequence, {_seconds('arrival_time')} AS arrival_time, "
+            f"{_seconds('departure_time')} AS departure_time, "
+            + _hash('trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time')
+            + " AS content_hash FROM {stage} s "
+            f"JOIN {Trip._meta.db_table} t ON t.trip_id = s.trip_id "
+            "ORDER BY t.id, s.stop_sequence::int"
+        ),
+        'depends': ['trips.txt'],
+    },
+]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_columns(path, *columns, required=()):
+    """Stream the named columns of a GTFS CSV file as tuples.
+
+    Columns missing from the file are yielded as empty strings unless they
+    are `required`, in which case ValueError is raised.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [column for column in required if column not in header]
+        if missing:
+            raise ValueError(f"{path.name} is missing columns: {', '.join(missing)}")
+        indexes = [header.index(column) if column in header else None for column in columns]
+        for row in reader:
+            if row:
+                yield tuple(row[i] if i is not None and i < len(row) else '' for i in indexes)
+
+
+class _CSVStream:
+    """File-like CSV view of a row iterator, for psycopg2's copy_expert"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pending = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            batch = list(itertools.islice(self.rows, COPY_BATCH_SIZE))
+            if not batch:
+                break
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            self.pending += buffer.getvalue()
+        if size < 0:
+            size = len(self.pending)
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY rows into `table` with whichever psycopg driver is installed"""
+    raw = cursor.cursor
+    if hasattr(raw, 'copy'):  # psycopg 3
+        with raw.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+    else:  # psycopg2
+        # FORCE_NOT_NULL keeps empty fields as '' rather than NULL, as in text COPY
+        column_list = ', '.join(columns)
+        raw.copy_expert(
+            f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({column_list}))",
+            _CSVStream(rows)
+        )
+
+
+def load_file(cursor, spec, path):
+    """Stage, normalise and merge one GTFS file; returns row counts"""
+    model = spec['model']
+    table = model._meta.db_table
+    stem = spec['name'].split('.')[0]
+    stage = f'gtfs_stage_{stem}'
+    incoming = f'gtfs_incoming_{stem}'
+
+    cursor.execute(
+        f"CREATE TEMP TABLE {stage} ({', '.join(f'{column} text' for column in spec['columns'])}) "
+        "ON COMMIT DROP"
+    )
+    copy_rows(cursor, stage, spec['columns'], read_columns(path, *spec['columns'], required=spec['required']))
+    cursor.execute(f"CREATE TEMP TABLE {incoming} ON COMMIT DROP AS {spec['select'].format(stage=stage)}")
+    cursor.execute(f'ANALYZE {incoming}')
+    cursor.execute(f'SELECT count(*) FROM {incoming}')
+    total = cursor.fetchone()[0]
+
+    fields = [
+        field.column for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    key = ', '.join(spec['key'])
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in fields if column not in spec['key'])
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(fields)}) SELECT {', '.join(fields)} FROM {incoming} "
+        f"ON CONFLICT ({key}) DO UPDATE SET {updates} "
+        f"WHERE {table}.content_hash IS DISTINCT FROM EXCLUDED.content_hash"
+    )
+    written = cursor.rowcount
+
+    if spec.get('before_delete'):
+        cursor.execute(spec['before_delete'].format(incoming=incoming))
+    matches = ' AND '.join(f'n.{column} = t.{column}' for column in spec['key'])
+    cursor.execute(f"DELETE FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM {incoming} n WHERE {matches})")
+    removed = cursor.rowcount
+
+    return {'rows': total, 'written': written, 'unchanged': total - written, 'removed': removed}
+
+
+def import_feed(gtfs_dir, force=False):
+    """Load changed GTFS files from `gtfs_dir` in one transaction.
+
+    Returns {file name: counts} for loaded files and {file name: None} for
+    files skipped as unchanged. Files absent from the feed are left alone.
+    """
+    results = {}
+    changed = set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for spec in FILES:
+            path = gtfs_dir / spec['name']
+            if not path.exists():
+                continue
+
+            digest = file_hash(path)
+            previous = FeedFile.objects.filter(name=spec['name']).values_list('sha256', flat=True).first()
+            dependency_changed = any(name in changed for name in spec.get('depends', ()))
+            if previous == digest and not force and not dependency_changed:
+                results[spec['name']] = None
+                continue
+
+            counts = load_file(cursor, spec, path)
+            FeedFile.objects.update_or_create(name=spec['name'], defaults={'sha256': digest, 'rows': counts['rows']})
+            changed.add(spec['name'])
+            results[spec['name']] = counts
+    return results
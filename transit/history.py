@@ -0,0 +1,155 @@
+"""
+Vehicle position history.
+
+transit_vehicleposition is range-partitioned by UTC day on ``timestamp``.
+Partitions are created on demand as positions are appended, dropped once
+they fall out of POSITION_HISTORY_RETENTION_DAYS, and thinned to one fix per
+vehicle per POSITION_HISTORY_DOWNSAMPLE_SECONDS once they are older than
+POSITION_HISTORY_DOWNSAMPLE_AFTER_DAYS. Queries that filter on timestamp
+only touch the partitions covering their window.
+"""
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, connection, transaction
+
+from .models import VehiclePosition
+
+TABLE = VehiclePosition._meta.db_table
+PARTITION_PATTERN = re.compile(rf'^{TABLE}_p(\d{{8}})$')
+
+INSERT_BATCH_SIZE = 1000
+
+# Days known to have a partition, so appends don't issue DDL every cycle
+_existing_partitions = set()
+
+
+def today():
+    return datetime.now(dt_timezone.utc).date()
+
+
+def partition_name(day):
+    return f'{TABLE}_p{day:%Y%m%d}'
+
+
+def ensure_partitions(days):
+    """Create the daily partitions covering `days` if they don't exist yet"""
+    missing = sorted(set(days) - _existing_partitions)
+    if not missing:
+        return
+    with connection.cursor() as cursor:
+        for day in missing:
+            start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+            end = start + timedelta(days=1)
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF {TABLE} '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+    # Only remember partitions whose creation actually committed
+    transaction.on_commit(lambda: _existing_partitions.update(missing))
+
+
+def list_partitions():
+    """Map each existing daily partition's day to its table name"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions[datetime.strptime(match.group(1), '%Y%m%d').date()] = name
+    return partitions
+
+
+def append_positions(vehicles):
+    """Append RealtimeVehicle rows to the history in bulk, in their own transaction"""
+    if not vehicles:
+        return 0
+    days = {vehicle.timestamp.astimezone(dt_timezone.utc).date() for vehicle in vehicles}
+    rows = [
+        VehiclePosition(
+            vehicle_id=vehicle.vehicle_id,
+            trip_id=vehicle.trip_id,
+            route_id=vehicle.route_id,
+            latitude=vehicle.latitude,
+            longitude=vehicle.longitude,
+            bearing=vehicle.bearing,
+            speed=vehicle.speed,
+            timestamp=vehicle.timestamp,
+        )
+        for vehicle in vehicles
+    ]
+    try:
+        _insert_positions(days, rows)
+    except IntegrityError:
+        # Rows without a partition are rejected. The known set is per
+        # process, so a partition dropped elsewhere may still be listed in
+        # it; forget those days and create them again before one retry.
+        _existing_partitions.difference_update(days)
+        _insert_positions(days, rows)
+    return len(rows)
+
+
+def _insert_positions(days, rows):
+    with transaction.atomic():
+        ensure_partitions(days)
+        VehiclePosition.objects.bulk_create(rows, batch_size=INSERT_BATCH_SIZE)
+
+
+def drop_partitions_before(day):
+    """Drop whole partitions older than `day`; returns the dropped days"""
+    dropped = []
+    with connection.cursor() as cursor:
+        for partition_day, name in sorted(list_partitions().items()):
+            if partition_day < day:
+                cursor.execute(f'DROP TABLE {name}')
+                _existing_partitions.discard(partition_day)
+                dropped.append(partition_day)
+    return dropped
+
+
+def downsample_partition(name, seconds):
+    """Keep only the first fix per vehicle per `seconds` bucket in a partition.
+
+    Partitions are marked with a table comment once thinned so later runs
+    skip them. Returns the number of deleted rows, or None if the partition
+    was already downsampled to this resolution.
+    """
+    marker = f'downsampled:{seconds}'
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')", [name])
+        if cursor.fetchone()[0] == marker:
+            return None
+
+        cursor.execute(
+            f'DELETE FROM {name} p USING ('
+            f'  SELECT id, row_number() OVER ('
+            f'    PARTITION BY vehicle_id, floor(extract(epoch FROM "timestamp") / %s)'
+            f'    ORDER BY "timestamp"'
+            f'  ) AS n FROM {name}'
+            f') ranked WHERE p.id = ranked.id AND ranked.n > 1',
+            [seconds]
+        )
+        deleted = cursor.rowcount
+        cursor.execute(f"COMMENT ON TABLE {name} IS '{marker}'")
+    return deleted
+
+
+def downsample_partitions_before(day, seconds):
+    """Downsample every partition older than `day`; returns deleted rows per day"""
+    results = {}
+    for partition_day, name in sorted(list_partitions().items()):
+        if partition_day >= day:
+            continue
+        deleted = downsample_partition(name, seconds)
+        if deleted is not None:
+            results[partition_day] = deleted
+    return results
@@ -0,0 +1,81 @@
+"""
+Persistence of decoded GTFS-RT snapshots.
+
+Shared by the one-shot fetch_rt_data command and the ingest_realtime daemon
+so both write vehicle positions the same way. Each snapshot is diffed
+against the stored rows by vehicle_id: only new or changed vehicles are
+written, through one bulk upsert, and only vanished vehicles are deleted.
+The written rows are then appended to the partitioned position history, in
+a separate transaction.
+"""
+import logging
+import time
+
+from django.db import DatabaseError, transaction
+
+from . import history, metrics
+from .models import RealtimeVehicle
+
+logger = logging.getLogger(__name__)
+
+# Columns compared when diffing and rewritten on conflict
+SYNCED_FIELDS = [
+    'license_plate', 'latitude', 'longitude', 'matched_latitude', 'matched_longitude',
+    'bearing', 'speed', 'timestamp', 'trip_id', 'route_id', 'current_status', 'current_stop_sequence',
+]
+
+UPSERT_BATCH_SIZE = 1000
+
+
+def _synced_values(vehicle):
+    return tuple(getattr(vehicle, field) for field in SYNCED_FIELDS)
+
+
+def store_vehicle_positions(positions):
+    """Sync the stored vehicle positions with a new snapshot.
+
+    Returns counts of written (inserted or updated), unchanged and removed
+    vehicles.
+    """
+    started = time.perf_counter()
+    # The feed may repeat a vehicle; the last entity wins
+    latest = {position.vehicle_id: position for position in positions}
+
+    current = {
+        row[0]: row[1:]
+        for row in RealtimeVehicle.objects.values_list('vehicle_id', *SYNCED_FIELDS)
+    }
+    changed = [
+        position for vehicle_id, position in latest.items()
+        if current.get(vehicle_id) != _synced_values(position)
+    ]
+    removed = current.keys() - latest.keys()
+
+    with transaction.atomic():
+        if changed:
+            RealtimeVehicle.objects.bulk_create(
+                changed,
+                batch_size=UPSERT_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['vehicle_id'],
+                update_fields=SYNCED_FIELDS,
+            )
+        if removed:
+            RealtimeVehicle.objects.filter(vehicle_id__in=removed).delete()
+
+    # Written after the live positions commit, so a history failure can't
+    # roll them back
+    try:
+        history.append_positions(changed)
+    except DatabaseError:
+        logger.exception('Appending vehicle position history failed')
+
+    counts = {
+        'written': len(changed),
+        'unchanged': len(latest) - len(changed),
+        'removed': len(removed),
+    }
+    metrics.INGEST_WRITE_SECONDS.observe(time.perf_counter() - started)
+    for result, count in counts.items():
+        metrics.INGEST_VEHICLES.labels(result=result).inc(count)
+    return counts
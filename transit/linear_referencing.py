@@ -0,0 +1,236 @@
+"""
+Linear referencing of points along route geometries.
+
+Route LineStrings are converted once into NumPy arrays of segments in a
+local metric projection, so projecting many points onto a route (distance
+along it and distance off it) is a handful of array operations instead of
+one GEOS call per point. All routes are also padded into shared arrays
+(RouteNetwork) so a whole fleet can be projected in one batch. The index is
+rebuilt whenever the network version changes.
+"""
+import math
+import threading
+
+import numpy as np
+
+from . import network_cache
+from .models import Route, RouteStop
+
+EARTH_RADIUS = 6371008.8  # metres
+
+# Vehicles projected per batch; bounds the (vehicles, segments, 2) temporaries
+PROJECT_CHUNK_SIZE = 256
+
+
+def to_metres(lons, lats, cos_lat):
+    """Equirectangular projection; `cos_lat` may be one value or one per point"""
+    lons = np.radians(np.asarray(lons, dtype=float))
+    lats = np.radians(np.asarray(lats, dtype=float))
+    return np.stack((lons * cos_lat * EARTH_RADIUS, lats * EARTH_RADIUS), axis=-1)
+
+
+def to_degrees(points, cos_lat):
+    """Inverse of to_metres"""
+    return (
+        np.degrees(points[..., 0] / (cos_lat * EARTH_RADIUS)),
+        np.degrees(points[..., 1] / EARTH_RADIUS),
+    )
+
+
+class RouteLine:
+    """Segments of one route geometry in metres, plus its stop offsets"""
+
+    def __init__(self, coords, stops=()):
+        coords = np.asarray(coords, dtype=float)
+        # Equirectangular projection around the route's own latitude is
+        # accurate to well under a metre over a bus route's extent
+        self.cos_lat = math.cos(math.radians(coords[:, 1].mean()))
+        points = self.to_metres(coords[:, 0], coords[:, 1])
+
+        self.starts = points[:-1]
+        self.vectors = points[1:] - points[:-1]
+        self.lengths_sq = np.maximum((self.vectors ** 2).sum(axis=1), 1e-9)
+        lengths = np.sqrt(self.lengths_sq)
+        self.offsets = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+        self.length = float(lengths.sum())
+
+        # (code, sequence, distance_along) sorted by distance along the route
+        stops = sorted(stops, key=lambda stop: stop[2])
+        self.stop_codes = [stop[0] for stop in stops]
+        self.stop_sequences = np.array([stop[1] for stop in stops], dtype=int)
+        self.stop_distances = np.array([stop[2] for stop in stops], dtype=float)
+
+    def to_metres(self, lons, lats):
+        return to_metres(lons, lats, self.cos_lat)
+
+    def _segment_candidates(self, points):
+        """Position along, and squared distance to, every segment for every point"""
+        # (points, segments, 2): every point against every segment at once
+        relative = points[:, None, :] - self.starts[None, :, :]
+        t = np.clip((relative * self.vectors[None, :, :]).sum(axis=2) / self.lengths_sq, 0.0, 1.0)
+        nearest = self.starts[None, :, :] + t[:, :, None] * self.vectors[None, :, :]
+        return t, ((points[:, None, :] - nearest) ** 2).sum(axis=2)
+
+    def project(self, lons, lats):
+        """Project points onto the route.
+
+        Returns (distance along the route, distance off the route) in metres,
+        one entry per point.
+        """
+        t, distances_sq = self._segment_candidates(self.to_metres(lons, lats))
+        best = distances_sq.argmin(axis=1)
+        rows = np.arange(len(best))
+        along = self.offsets[best] + t[rows, best] * np.sqrt(self.lengths_sq[best])
+        return along, np.sqrt(distances_sq[rows, best])
+
+    def project_in_order(self, lons, lats):
+        """Project an ordered sequence of points that never moves backwards.
+
+        Used for stops, so a stop on a route that doubles back on itself is
+        placed on the leg that follows the previous stop.
+        """
+        t, distances_sq = self._segment_candidates(self.to_metres(lons, lats))
+        along = self.offsets[None, :] + t * np.sqrt(self.lengths_sq)[None, :]
+
+        result = np.empty(len(along))
+        previous = 0.0
+        for i in range(len(along)):
+            candidates = np.where(along[i] >= previous, distances_sq[i], np.inf)
+            if not np.isfinite(candidates).any():
+                candidates = distances_sq[i]
+            best = candidates.argmin()
+            result[i] = previous = along[i, best]
+        return result
+
+
+class RouteNetwork:
+    """Every RouteLine padded into shared arrays, indexed by row.
+
+    Routes have different numbers of segments and stops; padding segments
+    are masked out and padding stops sit at infinity, so a fleet spread over
+    many routes is projected with the same array operations as one route.
+    """
+
+    def __init__(self, lines):
+        self.route_ids = list(lines)
+        self.rows = {route_id: row for row, route_id in enumerate(self.route_ids)}
+        lines = list(lines.values())
+        count = len(lines)
+        segments = max((len(line.starts) for line in lines), default=1)
+        stops = max((len(line.stop_codes) for line in lines), default=1) or 1
+
+        self.cos_lat = np.ones(count)
+        self.starts = np.zeros((count, segments, 2))
+        self.vectors = np.zeros((count, segments, 2))
+        self.lengths_sq = np.ones((count, segments))
+        self.offsets = np.zeros((count, segments))
+        self.valid = np.zeros((count, segments), dtype=bool)
+        self.stop_distances = np.full((count, stops), np.inf)
+        self.stop_sequences = np.zeros((count, stops), dtype=int)
+        self.stop_codes = []
+
+        for row, line in enumerate(lines):
+            n = len(line.starts)
+            self.cos_lat[row] = line.cos_lat
+            self.starts[row, :n] = line.starts
+            self.vectors[row, :n] = line.vectors
+            self.lengths_sq[row, :n] = line.lengths_sq
+            self.offsets[row, :n] = line.offsets
+            self.valid[row, :n] = True
+            k = len(line.stop_codes)
+            self.stop_distances[row, :k] = line.stop_distances
+            self.stop_sequences[row, :k] = line.stop_sequences
+            self.stop_codes.append(line.stop_codes)
+
+    def rows_for(self, route_ids):
+        """Row of each route id, or -1 for routes not in the network"""
+        return np.array([self.rows.get(route_id, -1) for route_id in route_ids], dtype=int)
+
+    def project(self, rows, lons, lats):
+        """Project points onto the routes at `rows` (all must be >= 0).
+
+        Returns (distance along, distance off, snapped longitude, snapped
+        latitude), one entry per point.
+        """
+        rows = np.asarray(rows, dtype=int)
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        along = np.empty(len(rows))
+        off_route = np.empty(len(rows))
+        snapped = np.empty((len(rows), 2))
+        for start in range(0, len(rows), PROJECT_CHUNK_SIZE):
+            chunk = slice(start, start + PROJECT_CHUNK_SIZE)
+            r = rows[chunk]
+            points = to_metres(lons[chunk], lats[chunk], self.cos_lat[r])
+
+            starts, vectors, lengths_sq = self.starts[r], self.vectors[r], self.lengths_sq[r]
+            relative = points[:, None, :] - starts
+            t = np.clip((relative * vectors).sum(axis=2) / lengths_sq, 0.0, 1.0)
+            nearest = starts + t[:, :, None] * vectors
+            distances_sq = np.where(self.valid[r], ((points[:, None, :] - nearest) ** 2).sum(axis=2), np.inf)
+
+            best = distances_sq.argmin(axis=1)
+            i = np.arange(len(best))
+            along[chunk] = self.offsets[r, best] + t[i, best] * np.sqrt(lengths_sq[i, best])
+            off_route[chunk] = np.sqrt(distances_sq[i, best])
+            snapped[chunk] = nearest[i, best]
+
+        snapped_lons, snapped_lats = to_degrees(snapped, self.cos_lat[rows])
+        return along, off_route, snapped_lons, snapped_lats
+
+
+def compute_stop_offsets():
+    """Store each RouteStop's distance along its route; returns rows updated"""
+    route_stops = RouteStop.objects.order_by('route_id', 'sequence').select_related('stop').only(
+        'id', 'route_id', 'sequence', 'stop__location'
+    )
+    by_route = {}
+    for rs in route_stops:
+        by_route.setdefault(rs.route_id, []).append(rs)
+
+    updated = []
+    for route_id, geometry in Route.objects.filter(id__in=by_route).values_list('id', 'geometry'):
+        stops = by_route[route_id]
+        line = RouteLine(geometry.coords)
+        along = line.project_in_order(
+            [rs.stop.location.x for rs in stops], [rs.stop.location.y for rs in stops]
+        )
+        for rs, distance in zip(stops, along):
+            rs.distance_along = float(distance)
+            updated.append(rs)
+
+    RouteStop.objects.bulk_update(updated, ['distance_along'], batch_size=1000)
+    # bulk_update sends no signals; the route index depends on these offsets.
+    # After commit, so the old offsets can't be cached under the new version.
+    network_cache.invalidate_on_commit()
+    return len(updated)
+
+
+_index_lock = threading.Lock()
+_index = {'version': None, 'network': None}
+
+
+def route_network():
+    """RouteNetwork of every route for the current network version"""
+    version = network_cache.version()
+    if _index['version'] != version:
+        with _index_lock:
+            if _index['version'] != version:
+                _index['network'] = RouteNetwork(_load_routes())
+                _index['version'] = version
+    return _index['network']
+
+
+def _load_routes():
+    stops = {}
+    route_stops = RouteStop.objects.filter(distance_along__isnull=False).values_list(
+        'route_id', 'stop__code', 'sequence', 'distance_along'
+    )
+    for route_id, code, sequence, distance in route_stops:
+        stops.setdefault(route_id, []).append((code, sequence, distance))
+
+    return {
+        route_id: RouteLine(geometry.coords, stops.get(pk, ()))
+        for pk, route_id, geometry in Route.objects.values_list('id', 'route_id', 'geometry')
+        if len(geometry.coords) >= 2
+    }
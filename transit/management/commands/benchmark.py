@@ -0,0 +1,179 @@
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from transit import eta, feed_cache, network_cache, views, wire_formats
+from transit.ingestion import store_vehicle_positions
+from transit.linear_referencing import compute_stop_offsets
+from transit.seed import seed_feed, seed_network
+from transit.services import parse_feed, process_vehicle_positions
+
+FIXTURE = settings.BASE_DIR / 'gtfs-realtime.pb'
+BASELINE = settings.BASE_DIR / 'benchmarks' / 'baseline.json'
+
+# Benchmarks seed and write rows, so they run against a throwaway test
+# database and a private cache, never the live ones
+BENCHMARK_SETTINGS = {
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'transit-benchmark',
+        }
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the realtime and read hot paths on feeds scaled from the bundled GTFS-RT fixture'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='10000,100000', help='Comma-separated vehicle counts')
+        parser.add_argument('--repeats', type=int, default=5, help='Timed runs per benchmark')
+        parser.add_argument('--baseline', type=str, default=str(BASELINE), help='Baseline results file')
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed median slowdown against the baseline, as a fraction')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Replace a leftover test database without asking')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.repeats = options['repeats']
+        template = parse_feed(FIXTURE.read_bytes())
+
+        results = {}
+        setup_test_environment()
+        live_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'], serialize=False)
+        try:
+            with override_settings(**BENCHMARK_SETTINGS):
+                _, routes, _ = seed_network(2000, 100, 40)
+                # Without offsets no stop is matched and no arrival estimated
+                compute_stop_offsets()
+                results.update(self.run_network_benchmarks())
+                for size in sizes:
+                    results.update(self.run_feed_benchmarks(seed_feed(template, size, routes), size))
+        finally:
+            connection.creation.destroy_test_db(live_name, verbosity=0)
+            teardown_test_environment()
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True))
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {baseline_path}'))
+        elif baseline_path.exists():
+            regressions = self.compare(results, json.loads(baseline_path.read_text()), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against baseline: ' + ', '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+        else:
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}; run with --save-baseline'))
+
+    def run_feed_benchmarks(self, feed, size):
+        content = feed.SerializeToString()
+        self.stdout.write(f'{size} vehicles ({len(content) / 1024:.0f} KiB of protobuf)')
+        feed = parse_feed(content)
+        positions = process_vehicle_positions(feed)
+        snapshot = feed_cache.snapshot_from_feed(feed, content=content, positions=positions)
+        snapshot['version'] = 1
+
+        # Alternate between two position sets so every write has changes
+        moved = process_vehicle_positions(feed)
+        for vehicle in moved:
+            vehicle.latitude += 0.0001
+        writes = [positions, moved]
+        # Estimate as of the newest fix, so the cloned fixture timestamps fall
+        # inside the horizon
+        now = max((vehicle.timestamp.timestamp() for vehicle in positions), default=None)
+
+        def write():
+            writes.reverse()
+            return store_vehicle_positions(writes[0])
+
+        benchmarks = [
+            ('decode', lambda: parse_feed(content)),
+            ('process_vehicle_positions', lambda: process_vehicle_positions(feed)),
+            ('snapshot', lambda: feed_cache.snapshot_from_feed(feed, content=content)),
+            ('positions json', lambda: json.dumps(feed_cache.snapshot_payload(snapshot), cls=DjangoJSONEncoder)),
+            ('positions columnar', lambda: wire_formats.encode_columnar(feed_cache.snapshot_payload(snapshot))),
+            ('positions binary', lambda: wire_formats.encode_binary(feed_cache.snapshot_payload(snapshot), 0.0)),
+            ('arrival estimates', lambda: eta.estimate_arrivals(positions, now)),
+            ('ingestion write', write),
+        ]
+        return {
+            f'{name}@{size}': self.measure(f'{name} @ {size}', run, size)
+            for name, run in benchmarks
+        }
+
+    def run_network_benchmarks(self):
+        factory = RequestFactory()
+
+        def cold_routes():
+            network_cache.invalidate()
+            return views.routes_geojson(factory.get(reverse('transit:routes-geojson')))
+
+        benchmarks = [
+            ('routes.geojson (cold)', cold_routes),
+            ('stops.json', lambda: views.get_stops_json(factory.get(reverse('transit:stops-json')))),
+            ('stops.json by bbox', lambda: views.get_stops_json(
+                factory.get(reverse('transit:stops-json'), {'bbox': '32.5,34.6,33.0,35.0', 'limit': 500})
+            )),
+        ]
+        return {name: self.measure(name, run, 1) for name, run in benchmarks}
+
+    def measure(self, label, run, items):
+        run()  # Warm up caches and lazy imports
+        timings = []
+        for _ in range(self.repeats):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # Tracing slows everything down, so peak memory gets a run of its own
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+        result = {
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'throughput': round(items / (p50 / 1000), 1) if p50 else None,
+            'peak_kib': round(peak / 1024),
+        }
+        throughput = f"{result['throughput']:,.0f}/s" if result['throughput'] is not None else 'n/a'
+        self.stdout.write(
+            f"  {label}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, "
+            f"{throughput}, peak {result['peak_kib']:,} KiB"
+        )
+        return result
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, result in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            ratio = result['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] else 1.0
+            line = f"{name}: p50 {previous['p50_ms']:.1f} -> {result['p50_ms']:.1f} ms ({ratio - 1:+.0%})"
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            elif ratio < 1 - tolerance:
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+        return regressions
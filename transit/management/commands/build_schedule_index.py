@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from transit.schedule_index import build_schedule_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-stop schedule index from the imported GTFS schedule'
+
+    def handle(self, *args, **options):
+        count = build_schedule_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} scheduled departures in {settings.SCHEDULE_INDEX_PATH}'
+        ))
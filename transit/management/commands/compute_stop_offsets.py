@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from transit.linear_referencing import compute_stop_offsets
+
+class Command(BaseCommand):
+    help = 'Precompute each route stop\'s distance along its route geometry'
+
+    def handle(self, *args, **options):
+        count = compute_stop_offsets()
+        self.stdout.write(self.style.SUCCESS(f'Computed offsets for {count} route stops'))
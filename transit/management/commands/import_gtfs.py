@@ -0,0 +1,40 @@
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from transit.gtfs_static import import_feed
+from transit.schedule_index import build_schedule_index
+
+class Command(BaseCommand):
+    help = 'Import the GTFS static schedule (calendar, trips, stop times, shapes), loading only changed files and rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('gtfs_dir', type=str, help='Path to GTFS directory')
+        parser.add_argument('--force', action='store_true', help='Reload files even if their hash is unchanged')
+
+    def handle(self, *args, **options):
+        gtfs_dir = Path(options['gtfs_dir'])
+        if not gtfs_dir.is_dir():
+            raise CommandError(f'{gtfs_dir} is not a directory')
+
+        try:
+            results = import_feed(gtfs_dir, force=options['force'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if not results:
+            self.stdout.write(self.style.WARNING(f'No GTFS schedule files found in {gtfs_dir}'))
+            return
+        for name, counts in results.items():
+            if counts is None:
+                self.stdout.write(f'{name}: unchanged, skipped')
+            else:
+                self.stdout.write(
+                    f"{name}: {counts['rows']} rows, {counts['written']} written, "
+                    f"{counts['unchanged']} unchanged, {counts['removed']} removed"
+                )
+
+        changed = any(counts is not None for counts in results.values())
+        if changed or not settings.SCHEDULE_INDEX_PATH.exists():
+            departures = build_schedule_index()
+            self.stdout.write(f'Indexed {departures} scheduled departures')
+        self.stdout.write(self.style.SUCCESS('GTFS schedule import complete'))
@@ -1,13 +1,18 @@
-import csv
+import sys
 from pathlib import Path
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from transit import network_cache, signals
+from transit.gtfs_static import read_columns
+from transit.linear_referencing import compute_stop_offsets
 from transit.models import Route, Stop, RouteStop
-from django.contrib.gis.geos import Point
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 5000
+
+
 class Command(BaseCommand):
     help = 'Import route-stop associations from GTFS feed'
 
@@ -26,49 +31,48 @@ class Command(BaseCommand):
 
         try:
             with transaction.atomic():
-                # Clear existing route-stop associations
-                RouteStop.objects.all().delete()
+                # Clear existing route-stop associations in one DELETE
+                with signals.muted():
+                    RouteStop.objects.all().delete()
+                network_cache.invalidate_on_commit()
                 
-                # Load trips to get route associations
-                trips_by_route = {}
-                with open(gtfs_dir / 'trips.txt', 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        trips_by_route[row['trip_id']] = row['route_id']
-                
-                # Load stop times and build route-stop associations
-                stop_sequences = {}  # (route_id, stop_id) -> set of sequences
-                with open(gtfs_dir / 'stop_times.txt', 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        trip_id = row['trip_id']
-                        route_id = trips_by_route.get(trip_id)
-                        if route_id:
-                            key = (route_id, row['stop_id'])
-                            if key not in stop_sequences:
-                                stop_sequences[key] = set()
-                            stop_sequences[key].add(int(row['stop_sequence']))
+                # Only trip -> route is kept from trips.txt; route ids are
+                # interned so each distinct id is stored once
+                trip_routes = {
+                    trip_id: sys.intern(route_id)
+                    for trip_id, route_id in read_columns(gtfs_dir / 'trips.txt', 'trip_id', 'route_id')
+                }
+
+                # Stream stop_times.txt keeping only the lowest sequence per
+                # (route_id, stop_id), so memory grows with the number of
+                # distinct route stops rather than with stop events
+                min_sequences = {}
+                rows = read_columns(gtfs_dir / 'stop_times.txt', 'trip_id', 'stop_id', 'stop_sequence')
+                for trip_id, stop_id, sequence in rows:
+                    route_id = trip_routes.get(trip_id)
+                    if route_id:
+                        key = (route_id, stop_id)
+                        sequence = int(sequence)
+                        if sequence < min_sequences.get(key, sequence + 1):
+                            min_sequences[key] = sequence
+                del trip_routes
 
                 # Create RouteStop entries
                 route_stops = []
-                routes = {route.route_id: route for route in Route.objects.all()}
-                stops = {stop.code: stop for stop in Stop.objects.all()}
+                routes = dict(Route.objects.values_list('route_id', 'id'))
+                stops = dict(Stop.objects.values_list('code', 'id'))
 
-                for (route_id, stop_id), sequences in stop_sequences.items():
+                for (route_id, stop_id), sequence in min_sequences.items():
                     route = routes.get(route_id)
                     stop = stops.get(stop_id)
                     if route and stop:
-                        # Use the minimum sequence number for this stop on this route
-                        sequence = min(sequences)
-                        route_stops.append(RouteStop(
-                            route=route,
-                            stop=stop,
-                            sequence=sequence
-                        ))
+                        route_stops.append(RouteStop(route_id=route, stop_id=stop, sequence=sequence))
 
                 # Bulk create route-stop associations
                 if route_stops:
-                    RouteStop.objects.bulk_create(route_stops)
+                    RouteStop.objects.bulk_create(route_stops, batch_size=BATCH_SIZE)
+                    offsets = compute_stop_offsets()
+                    self.stdout.write(f'Computed offsets for {offsets} route stops')
                     self.stdout.write(self.style.SUCCESS(
                         f'Successfully imported {len(route_stops)} route-stop associations'
                     ))
@@ -1,15 +1,41 @@
+import hashlib
 import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from django.contrib.gis.gdal import DataSource
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.db import transaction
+from transit import network_cache
+from transit.linear_referencing import compute_stop_offsets
 from transit.models import Route
+from transit.simplification import build_simplified_geometries
 from django.utils import timezone
-import re
+
+BATCH_SIZE = 500
+
+# Layers with fewer changed features are parsed on the main thread
+PARALLEL_THRESHOLD = 200
+
+
+def parse_geometry(wkb):
+    """A route's geometry from its WKB; returns (geometry, None) or (None, error)"""
+    # WKB goes straight to GEOS, which releases the GIL while parsing
+    try:
+        geometry = GEOSGeometry(memoryview(wkb), srid=4326)
+    except (GEOSException, ValueError) as e:
+        return None, str(e)
+    if geometry.geom_type != 'LineString' or len(geometry) < 2:
+        return None, f'expected a LineString of at least 2 points, got {geometry.geom_type}'
+    return geometry, None
 
 class Command(BaseCommand):
-    help = 'Import routes from Shapefile'
+    help = 'Import routes from Shapefile, writing only new and changed routes'
 
     def add_arguments(self, parser):
         parser.add_argument('shp_path', type=str, help='Full path to routes.shp file')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Threads converting geometries for large layers')
 
     def parse_time(self, time_str):
         try:
@@ -24,9 +50,51 @@ class Command(BaseCommand):
             return None
 
     def generate_color(self, LINE_NAME_):
-        base_hash = hash(LINE_NAME_) % 0xFFFFFF
+        # crc32 rather than hash(), which is salted per process and would
+        # give every route a new colour (and content hash) on each import
+        base_hash = zlib.crc32(str(LINE_NAME_).encode()) % 0xFFFFFF
         return f"#{base_hash:06x}"
 
+    def read_feature(self, feature):
+        """Attributes and raw WKB geometry of one feature, or None to skip it"""
+        # Use LINE_ID as route_id since it's more stable than LINE_NAME_
+        route_id = feature['LINE_ID'].value
+        if not route_id:
+            self.stdout.write(self.style.WARNING(f"Skipping feature with empty LINE_ID"))
+            return None
+
+        route_data = {
+            'route_id': route_id,
+            'line_name': feature['LINE_NAME'].value,
+            'route_name': feature['ROUTE_NAME'].value,
+            'direction': feature['DIRECTION'].value,
+            'length': self.parse_float(feature['LINE_LENGT'].value),
+            'first_stop': feature['FIRST_STOP'].value,
+            'last_stop': feature['LAST_STOP_'].value,
+            'stops_list': feature['STOPS'].value,
+            'color': self.generate_color(route_id),
+            'weekday_start': self.parse_time(feature['WD_START_H'].value),
+            'weekday_end': self.parse_time(feature['WD_LAST_HO'].value),
+            'weekday_morning_frequency': feature['WD_MORNING'].value,
+            'weekday_afternoon_frequency': feature['WD_AFTERNO'].value,
+            'weekday_trips': feature['WD_COUNT'].value,
+            'saturday_start': self.parse_time(feature['SAT_START_'].value),
+            'saturday_end': self.parse_time(feature['SAT_LAST_H'].value),
+            'saturday_morning_frequency': feature['SAT_MORNIN'].value,
+            'saturday_afternoon_frequency': feature['SAT_AFTERN'].value,
+            'saturday_trips': feature['SAT_COUNT'].value,
+            'holiday_start': self.parse_time(feature['HOL_START_'].value),
+            'holiday_end': self.parse_time(feature['HOL_LAST_H'].value),
+            'holiday_morning_frequency': feature['HOL_MORNIN'].value,
+            'holiday_afternoon_frequency': feature['HOL_AFTERN'].value,
+            'holiday_trips': feature['HOL_COUNT'].value,
+        }
+        wkb = bytes(feature.geom.wkb)
+        digest = hashlib.md5(repr(sorted(route_data.items())).encode())
+        digest.update(wkb)
+        route_data['content_hash'] = digest.hexdigest()
+        return route_data, wkb
+
     def handle(self, *args, **options):
         shp_path = options['shp_path']
         
@@ -37,69 +105,75 @@ class Command(BaseCommand):
         ds = DataSource(shp_path)
         layer = ds[0]
         
-        created_count = 0
         skipped_count = 0
         
         # Add debug output at start
         self.stdout.write(f"Found {len(layer)} features")
         self.stdout.write(f"Shapefile fields: {layer.fields}")
-        
+
+        # Attributes are read on this thread; GDAL objects are not shared
+        features = {}
         for feature in layer:
             try:
-                # Use LINE_ID as route_id since it's more stable than LINE_NAME_
-                route_id = feature['LINE_ID'].value
-                if not route_id:
-                    self.stdout.write(self.style.WARNING(f"Skipping feature with empty LINE_ID"))
-                    skipped_count += 1
-                    continue
-
-                route_data = {
-                    'route_id': route_id,
-                    'line_name': feature['LINE_NAME'].value,
-                    'route_name': feature['ROUTE_NAME'].value,
-                    'direction': feature['DIRECTION'].value,
-                    'length': self.parse_float(feature['LINE_LENGT'].value),
-                    'first_stop': feature['FIRST_STOP'].value,
-                    'last_stop': feature['LAST_STOP_'].value,
-                    'stops_list': feature['STOPS'].value,
-                    'geometry': feature.geom.wkt,
-                    'color': self.generate_color(route_id),
-                    'weekday_start': self.parse_time(feature['WD_START_H'].value),
-                    'weekday_end': self.parse_time(feature['WD_LAST_HO'].value),
-                    'weekday_morning_frequency': feature['WD_MORNING'].value,
-                    'weekday_afternoon_frequency': feature['WD_AFTERNO'].value,
-                    'weekday_trips': feature['WD_COUNT'].value,
-                    'saturday_start': self.parse_time(feature['SAT_START_'].value),
-                    'saturday_end': self.parse_time(feature['SAT_LAST_H'].value),
-                    'saturday_morning_frequency': feature['SAT_MORNIN'].value,
-                    'saturday_afternoon_frequency': feature['SAT_AFTERN'].value,
-                    'saturday_trips': feature['SAT_COUNT'].value,
-                    'holiday_start': self.parse_time(feature['HOL_START_'].value),
-                    'holiday_end': self.parse_time(feature['HOL_LAST_H'].value),
-                    'holiday_morning_frequency': feature['HOL_MORNIN'].value,
-                    'holiday_afternoon_frequency': feature['HOL_AFTERN'].value,
-                    'holiday_trips': feature['HOL_COUNT'].value,
-                }
-
-                Route.objects.update_or_create(
-                    route_id=route_data['route_id'],
-                    defaults=route_data
-                )
-                created_count += 1
-                
-                if created_count % 10 == 0:  # Progress update every 10 routes
-                    self.stdout.write(f"Processed {created_count} routes...")
-
+                parsed = self.read_feature(feature)
             except KeyError as e:
                 self.stdout.write(self.style.ERROR(
-                    f"Missing field {str(e)} in feature {feature.get('ID', {}).value}"
+                    f"Missing field {str(e)} in feature {feature.fid}"
                 ))
+                parsed = None
             except Exception as e:
                 self.stdout.write(self.style.WARNING(
-                    f"Error processing route {route_id if 'route_id' in locals() else 'unknown'}: {str(e)}"
+                    f"Error processing feature {feature.fid}: {str(e)}"
                 ))
+                parsed = None
+            if parsed is None:
                 skipped_count += 1
+                continue
+            features[parsed[0]['route_id']] = parsed
+
+        existing = dict(Route.objects.values_list('route_id', 'content_hash'))
+        pending = [
+            (route_data, wkb) for route_id, (route_data, wkb) in features.items()
+            if existing.get(route_id) != route_data['content_hash']
+        ]
+        unchanged_count = len(features) - len(pending)
+
+        wkbs = [wkb for _, wkb in pending]
+        if len(pending) >= PARALLEL_THRESHOLD and options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                geometries = list(executor.map(parse_geometry, wkbs))
+        else:
+            geometries = [parse_geometry(wkb) for wkb in wkbs]
+        # A bad geometry skips its route rather than failing the import
+        routes = []
+        for (route_data, _), (geometry, error) in zip(pending, geometries):
+            if error is not None:
+                self.stdout.write(self.style.WARNING(
+                    f"Error processing route {route_data['route_id']}: {error}"
+                ))
+                skipped_count += 1
+                continue
+            routes.append(Route(geometry=geometry, **route_data))
+
+        if routes:
+            # One transaction, so a failure never leaves a partially imported
+            # network behind
+            with transaction.atomic():
+                Route.objects.bulk_create(
+                    routes,
+                    batch_size=BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=['route_id'],
+                    update_fields=[name for name in pending[0][0] if name != 'route_id'] + ['geometry'],
+                )
+                levels = build_simplified_geometries()
+                offsets = compute_stop_offsets()
+                # bulk_create sends no signals, so invalidate explicitly
+                network_cache.invalidate_on_commit()
+            self.stdout.write(f"Built {levels} simplified route geometries")
+            self.stdout.write(f"Computed offsets for {offsets} route stops")
 
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully imported/updated {created_count} routes ({skipped_count} skipped)'
-        ))
\ No newline at end of file
+            f'Imported {len(features)} routes: {len(routes)} written, {unchanged_count} unchanged '
+            f'({skipped_count} skipped)'
+        ))
@@ -1,19 +1,30 @@
 from django.core.management.base import BaseCommand
 import csv
+import hashlib
+from django.db import transaction
+from transit import network_cache, signals
+from transit.linear_referencing import compute_stop_offsets
 from transit.models import Stop
 from django.contrib.gis.geos import Point
 
+BATCH_SIZE = 1000
+
+UPDATE_FIELDS = ['description', 'description_el', 'description_en', 'location', 'content_hash']
+
 class Command(BaseCommand):
-    help = 'Import stops from CSV file'
+    help = 'Import stops from CSV file, writing only new and changed stops'
 
     def add_arguments(self, parser):
         parser.add_argument('csv_path', type=str, help='Path to stops.csv')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete stops missing from the file (and their route links)')
 
     def handle(self, *args, **options):
         path = options['csv_path']
-        count = 0
         errors = 0
-        
+
+        # Parse the whole file first; the last row for a code wins
+        parsed = {}
         with open(path, 'r', encoding='utf-8-sig') as f:
             reader = csv.DictReader(f, delimiter=';')
             
@@ -22,23 +33,55 @@ class Command(BaseCommand):
                     # Convert numeric values with locale handling
                     lat = float(row['lat'].replace(',', '.'))
                     lon = float(row['lon'].replace(',', '.'))
-                    
-                    Stop.objects.update_or_create(
-                        code=row['code'],
-                        defaults={
-                            'description': row['description'],
-                            'description_el': row['description[el]'],
-                            'description_en': row['description[en]'],
-                            'location': Point(lon, lat)  # Note: longitude first
-                        }
-                    )
-                    count += 1
-                except (ValueError, KeyError) as e:
+                    values = (row['code'], row['description'], row['description[el]'], row['description[en]'], lat, lon)
+                except (ValueError, KeyError, AttributeError) as e:
                     self.stdout.write(self.style.WARNING(
                         f"Skipping row {row}: {str(e)}"
                     ))
                     errors += 1
+                    continue
+
+                parsed[row['code']] = Stop(
+                    code=row['code'],
+                    description=row['description'],
+                    description_el=row['description[el]'],
+                    description_en=row['description[en]'],
+                    location=Point(lon, lat, srid=4326),  # Note: longitude first
+                    content_hash=hashlib.md5(repr(values).encode()).hexdigest(),
+                )
+
+        existing = dict(Stop.objects.values_list('code', 'content_hash'))
+        added = [stop for code, stop in parsed.items() if code not in existing]
+        changed = [stop for code, stop in parsed.items() if code in existing and existing[code] != stop.content_hash]
+        removed = existing.keys() - parsed.keys()
+
+        pruned = removed if options['prune'] else set()
+
+        with transaction.atomic():
+            if added or changed:
+                Stop.objects.bulk_create(
+                    added + changed,
+                    batch_size=BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=['code'],
+                    update_fields=UPDATE_FIELDS,
+                )
+            if pruned:
+                with signals.muted():
+                    Stop.objects.filter(code__in=pruned).delete()
+            if changed or pruned:
+                # Moved or deleted stops shift distances along their routes
+                compute_stop_offsets()
+            if added or changed or pruned:
+                # bulk_create sends no signals, so invalidate explicitly
+                network_cache.invalidate_on_commit()
 
+        if removed and not pruned:
+            self.stdout.write(self.style.WARNING(
+                f'{len(removed)} stops are no longer in the file; run with --prune to remove them'
+            ))
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully processed {count} stops ({errors} errors)'
-        ))
\ No newline at end of file
+            f'Processed {len(parsed)} stops: {len(added)} added, {len(changed)} changed, '
+            f'{len(parsed) - len(added) - len(changed)} unchanged, {len(pruned)} removed '
+            f'({errors} errors)'
+        ))
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from transit import departures, eta, feed_cache
+from transit.ingestion import store_vehicle_positions
+from transit.services import fetch_feed_content, parse_feed, process_vehicle_positions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Continuously ingest realtime vehicle positions from the GTFS-RT feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', type=str, help='GTFS-RT endpoint URL')
+        parser.add_argument('--interval', type=float, help='Seconds between polls')
+
+    def handle(self, *args, **options):
+        self.url = options.get('url') or settings.GTFS_RT_URL
+        self.interval = options.get('interval') or settings.GTFS_RT_REFRESH_INTERVAL
+
+        self.stdout.write(f"Polling {self.url} every {self.interval:g}s")
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            self.stdout.write('Ingestion stopped')
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        # One keep-alive connection to the upstream, reused by every poll
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        # Blocking work runs on dedicated threads: fetching never waits for a
+        # slow database write, and each thread keeps its own DB connection.
+        fetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rt-fetch')
+        write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rt-write')
+
+        pending = asyncio.Queue(maxsize=1)
+        writer = asyncio.create_task(self.write_loop(pending, write_executor))
+
+        cycle = 0
+        failures = 0
+        next_poll = loop.time()
+        try:
+            while True:
+                cycle += 1
+                try:
+                    positions, timings = await loop.run_in_executor(
+                        fetch_executor, self.poll, session
+                    )
+                except Exception as e:
+                    failures += 1
+                    delay = self.backoff(failures)
+                    self.stdout.write(self.style.WARNING(
+                        f"Cycle {cycle}: {str(e)} (retrying in {delay:.1f}s)"
+                    ))
+                    await asyncio.sleep(delay)
+                    next_poll = loop.time()
+                    continue
+
+                failures = 0
+                self.offer(pending, (cycle, positions))
+                self.stdout.write(
+                    f"Cycle {cycle}: {len(positions)} vehicles, "
+                    f"fetch {timings['fetch']:.0f} ms, parse {timings['parse']:.0f} ms, "
+                    f"publish {timings['publish']:.0f} ms, eta {timings['eta']:.0f} ms"
+                )
+
+                # Keep a fixed schedule; skip ticks rather than bunching up
+                next_poll += self.interval
+                if next_poll < loop.time():
+                    next_poll = loop.time()
+                await asyncio.sleep(next_poll - loop.time())
+        finally:
+            writer.cancel()
+            session.close()
+            fetch_executor.shutdown(wait=False)
+            write_executor.shutdown(wait=True)
+
+    def poll(self, session):
+        """Fetch, decode and publish one snapshot, its departures and arrival estimates; returns positions to store"""
+        timings = {}
+
+        started = time.perf_counter()
+        content = fetch_feed_content(self.url, timeout=settings.GTFS_RT_TIMEOUT, session=session)
+        timings['fetch'] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        feed = parse_feed(content)
+        positions = process_vehicle_positions(feed)
+        snapshot = feed_cache.snapshot_from_feed(feed, content=content, positions=positions)
+        timings['parse'] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        feed_cache.store_snapshot(snapshot)
+        # The snapshot is already published, so departures and estimates
+        # failing must not fail the cycle and keep positions from the writer
+        try:
+            departures.publish(feed, snapshot['fetched_at'])
+        except Exception:
+            logger.exception('Publishing departures from the GTFS-RT snapshot failed')
+        timings['publish'] = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        try:
+            eta.update(positions)
+        except Exception:
+            logger.exception('Updating arrival estimates failed')
+        timings['eta'] = (time.perf_counter() - started) * 1000
+
+        return positions, timings
+
+    def offer(self, pending, item):
+        """Queue a snapshot for writing, replacing one the writer has not picked up"""
+        if pending.full():
+            _, dropped = pending.get_nowait()
+            self.stdout.write(self.style.WARNING(
+                f"Writer behind, dropping snapshot of {len(dropped)} vehicles"
+            ))
+        pending.put_nowait(item)
+
+    async def write_loop(self, pending, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            cycle, positions = await pending.get()
+            started = time.perf_counter()
+            try:
+                counts = await loop.run_in_executor(executor, self.write, positions)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Cycle {cycle}: write failed: {str(e)}"))
+                continue
+            self.stdout.write(
+                f"Cycle {cycle}: wrote {counts['written']} vehicles "
+                f"({counts['unchanged']} unchanged, {counts['removed']} removed) in "
+                f"{(time.perf_counter() - started) * 1000:.0f} ms"
+            )
+
+    def write(self, positions):
+        close_old_connections()
+        return store_vehicle_positions(positions)
+
+    def backoff(self, failures):
+        """Exponential backoff with jitter so restarts don't poll in lockstep"""
+        ceiling = min(settings.GTFS_RT_MAX_BACKOFF, self.interval * 2 ** min(failures - 1, 10))
+        return random.uniform(ceiling / 2, ceiling)
@@ -1,58 +1,67 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from transit import network_cache
+from transit.linear_referencing import compute_stop_offsets
 from transit.models import Route, Stop, RouteStop
 
+BATCH_SIZE = 5000
+
+# Unresolved codes listed individually in the report
+REPORT_LIMIT = 50
+
+
+def normalise_code(code):
+    """Stop code without leading zeros, so '0042' and '42' match"""
+    return code.strip().lstrip('0') or '0'
+
+
 class Command(BaseCommand):
     help = 'Link routes to stops using the stops_list field'
 
     def handle(self, *args, **options):
-        routes = Route.objects.all()
-        total_links = 0
-        
-        for route in routes:
-            if not route.stops_list:
+        # Exact codes win over normalised ones when both exist
+        stop_ids = {}
+        exact = {}
+        for code, stop_id in Stop.objects.values_list('code', 'id'):
+            exact[code] = stop_id
+            stop_ids.setdefault(normalise_code(code), stop_id)
+
+        links = []
+        unresolved = {}  # code -> route_ids listing it
+        for route_id, route_code, stops_list in Route.objects.values_list('id', 'route_id', 'stops_list'):
+            if not stops_list:
                 continue
-                
+
             # Split the stops list and filter out empty strings
-            stop_codes = [code.strip() for code in route.stops_list.split(',') if code.strip()]
-            
-            # Create RouteStop entries
+            stop_codes = [code.strip() for code in stops_list.split(',') if code.strip()]
             for sequence, code in enumerate(stop_codes, start=1):
-                try:
-                    # Try different formats of the stop code
-                    stop = None
-                    codes_to_try = [
-                        code,  # Original code
-                        code.lstrip('0'),  # Remove leading zeros
-                        str(int(code)) if code.isdigit() else code,  # Convert to int and back to remove leading zeros
-                    ]
-                    
-                    for try_code in codes_to_try:
-                        try:
-                            stop = Stop.objects.get(code=try_code)
-                            break
-                        except Stop.DoesNotExist:
-                            continue
-                    
-                    if stop:
-                        RouteStop.objects.get_or_create(
-                            route=route,
-                            stop=stop,
-                            sequence=sequence
-                        )
-                        total_links += 1
-                        
-                        if total_links % 1000 == 0:
-                            self.stdout.write(f"Created {total_links} links...")
-                    else:
-                        self.stdout.write(self.style.WARNING(
-                            f"Stop with code {code} not found for route {route.route_id}"
-                        ))
-                        
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(
-                        f"Error linking stop {code} to route {route.route_id}: {str(e)}"
-                    ))
-        
+                stop_id = exact.get(code) or stop_ids.get(normalise_code(code))
+                if stop_id is None:
+                    unresolved.setdefault(code, []).append(route_code)
+                    continue
+                links.append(RouteStop(route_id=route_id, stop_id=stop_id, sequence=sequence))
+
+        with transaction.atomic():
+            # Existing links, and stops listed twice on a route, are skipped;
+            # ignored rows are not reported back, so count the table instead
+            existing = RouteStop.objects.count()
+            RouteStop.objects.bulk_create(links, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            inserted = RouteStop.objects.count() - existing
+            offsets = compute_stop_offsets()
+            # bulk_create sends no signals, so invalidate explicitly
+            network_cache.invalidate_on_commit()
+        self.stdout.write(f'Computed offsets for {offsets} route stops')
+
+        if unresolved:
+            self.stdout.write(self.style.WARNING(
+                f'{len(unresolved)} stop codes not found '
+                f'({sum(len(routes) for routes in unresolved.values())} route references):'
+            ))
+            for code, routes in sorted(unresolved.items())[:REPORT_LIMIT]:
+                self.stdout.write(f"  {code}: {', '.join(sorted(set(routes)))}")
+            if len(unresolved) > REPORT_LIMIT:
+                self.stdout.write(f'  ... and {len(unresolved) - REPORT_LIMIT} more')
+
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully created {total_links} route-stop links'
+            f'Successfully linked {inserted} route stops ({len(links) - inserted} already present)'
         ))
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from transit.profiling import make_token
+
+class Command(BaseCommand):
+    help = 'Issue a signed header value that enables profiling of the requests sending it'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(
+            f'Valid for {settings.PROFILING_TOKEN_MAX_AGE}s, send as:'
+        ))
+        self.stdout.write(f'{settings.PROFILING_HEADER}: {make_token()}')
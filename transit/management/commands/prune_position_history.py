@@ -0,0 +1,42 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from transit import history
+
+class Command(BaseCommand):
+    help = 'Drop expired vehicle position history and downsample older partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, help='Days of history to keep')
+        parser.add_argument('--downsample-after-days', type=int, help='Age in days after which history is downsampled')
+        parser.add_argument('--downsample-seconds', type=int, help='Resolution of downsampled history in seconds')
+
+    def handle(self, *args, **options):
+        # An explicit 0 is a valid value, so only a missing option falls back
+        retention_days = options['retention_days']
+        if retention_days is None:
+            retention_days = settings.POSITION_HISTORY_RETENTION_DAYS
+        downsample_after = options['downsample_after_days']
+        if downsample_after is None:
+            downsample_after = settings.POSITION_HISTORY_DOWNSAMPLE_AFTER_DAYS
+        downsample_seconds = options['downsample_seconds']
+        if downsample_seconds is None:
+            downsample_seconds = settings.POSITION_HISTORY_DOWNSAMPLE_SECONDS
+        today = history.today()
+
+        # Create today's and tomorrow's partitions ahead of the ingestion path
+        history.ensure_partitions([today, today + timedelta(days=1)])
+
+        dropped = history.drop_partitions_before(today - timedelta(days=retention_days))
+        for day in dropped:
+            self.stdout.write(f"Dropped partition for {day}")
+
+        downsampled = history.downsample_partitions_before(
+            today - timedelta(days=downsample_after), downsample_seconds
+        )
+        for day, deleted in downsampled.items():
+            self.stdout.write(f"Downsampled {day} to {downsample_seconds}s ({deleted} rows removed)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Dropped {len(dropped)} partitions, downsampled {len(downsampled)}'
+        ))
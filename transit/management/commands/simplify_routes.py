@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from transit.simplification import build_simplified_geometries
+
+class Command(BaseCommand):
+    help = 'Precompute simplified route geometries for low zoom levels'
+
+    def handle(self, *args, **options):
+        count = build_simplified_geometries()
+        self.stdout.write(self.style.SUCCESS(f'Built {count} simplified route geometries'))
@@ -0,0 +1,74 @@
+"""
+Map matching of realtime vehicle positions onto their routes.
+
+Every vehicle in a snapshot is snapped to the nearest segment of its route
+in one batch (see transit.linear_referencing.RouteNetwork), and its stop
+progress is derived from where it sits relative to the route's stops:
+STOPPED_AT within MAP_MATCH_STOPPED_DISTANCE of a stop, INCOMING_AT within
+MAP_MATCH_INCOMING_DISTANCE of the next one, IN_TRANSIT otherwise.
+"""
+import numpy as np
+from django.conf import settings
+
+from .linear_referencing import route_network
+
+
+def match_vehicles(vehicles):
+    """Snap RealtimeVehicles onto their routes in place.
+
+    Matched vehicles get the snapped point in matched_latitude and
+    matched_longitude, a derived current_stop_sequence and current_status,
+    and a ``distance_along`` attribute in metres; the raw GPS fix in latitude
+    and longitude is kept. Vehicles without a known route, or further than
+    MAP_MATCH_MAX_DISTANCE from it, keep their feed values and get None for
+    all three. Returns the number of vehicles matched.
+    """
+    for vehicle in vehicles:
+        vehicle.distance_along = None
+        vehicle.matched_latitude = vehicle.matched_longitude = None
+    if not vehicles:
+        return 0
+
+    network = route_network()
+    rows = network.rows_for([vehicle.route_id for vehicle in vehicles])
+    known = np.flatnonzero(rows >= 0)
+    if not len(known):
+        return 0
+
+    rows = rows[known]
+    along, off_route, lons, lats = network.project(
+        rows,
+        [vehicles[i].longitude for i in known],
+        [vehicles[i].latitude for i in known],
+    )
+
+    # (vehicles, stops): signed distance from each vehicle to each stop on its route
+    gaps = network.stop_distances[rows] - along[:, None]
+    sequences = network.stop_sequences[rows]
+    i = np.arange(len(rows))
+
+    nearest = np.abs(gaps).argmin(axis=1)
+    stopped = np.abs(gaps[i, nearest]) <= settings.MAP_MATCH_STOPPED_DISTANCE
+
+    # Padding stops sit at infinity, so argmax finds the first real stop
+    # ahead, or a padding column once a vehicle is past its last stop
+    ahead = gaps > 0
+    upcoming = ahead.argmax(axis=1)
+    has_upcoming = ahead[i, upcoming] & np.isfinite(gaps[i, upcoming])
+    incoming = has_upcoming & (gaps[i, upcoming] <= settings.MAP_MATCH_INCOMING_DISTANCE)
+
+    matched = off_route <= settings.MAP_MATCH_MAX_DISTANCE
+    for j in np.flatnonzero(matched):
+        vehicle = vehicles[known[j]]
+        vehicle.matched_longitude = float(lons[j])
+        vehicle.matched_latitude = float(lats[j])
+        vehicle.distance_along = float(along[j])
+        if stopped[j]:
+            vehicle.current_status = 'STOPPED_AT'
+            vehicle.current_stop_sequence = int(sequences[j, nearest[j]])
+        elif has_upcoming[j]:
+            vehicle.current_status = 'INCOMING_AT' if incoming[j] else 'IN_TRANSIT'
+            vehicle.current_stop_sequence = int(sequences[j, upcoming[j]])
+        else:
+            vehicle.current_status = 'IN_TRANSIT'
+    return int(matched.sum())
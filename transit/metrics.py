@@ -0,0 +1,136 @@
+"""
+Counters, histograms and gauges exposed in the Prometheus text format.
+
+Metrics are prometheus_client metrics. When PROMETHEUS_MULTIPROC_DIR is set
+(config/settings.py points it at METRICS_DIR) every process records into
+that directory through the library's multiprocess mode, so the /metrics
+endpoint served by any web worker also reports the other workers and the
+ingest_realtime daemon. Gauges only report processes still running; see the
+README for clearing the directory on restart and marking exited workers.
+"""
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.http import Http404
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    # Values are written as soon as metrics are defined below
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# Upstream feed
+FEED_FETCH_SECONDS = Histogram('transit_feed_fetch_seconds', 'Time fetching the GTFS-RT feed')
+FEED_FETCH_BYTES = Counter('transit_feed_fetch_bytes_total', 'GTFS-RT feed bytes fetched')
+FEED_FETCH_ERRORS = Counter('transit_feed_fetch_errors_total', 'Failed GTFS-RT feed fetches')
+FEED_PARSE_SECONDS = Histogram('transit_feed_parse_seconds', 'Time decoding GTFS-RT protobuf')
+FEED_ENTITIES = Gauge(
+    'transit_feed_entities', 'Entities in the last decoded GTFS-RT feed', ['kind'],
+    multiprocess_mode='livemostrecent',
+)
+FEED_TIMESTAMP = Gauge(
+    'transit_feed_timestamp_seconds', 'Header timestamp of the newest decoded GTFS-RT feed',
+    multiprocess_mode='livemax',
+)
+FEED_AGE = Gauge(
+    'transit_feed_age_seconds', 'Age of the shared snapshot\'s feed at scrape time',
+    multiprocess_mode='livemostrecent',
+)
+
+# Realtime processing and ingestion
+PROCESS_SECONDS = Histogram('transit_process_positions_seconds', 'Time building and map matching vehicle positions')
+VEHICLES = Gauge(
+    'transit_vehicles', 'Vehicles in the last processed feed', ['matched'], multiprocess_mode='livemostrecent'
+)
+INGEST_WRITE_SECONDS = Histogram('transit_ingest_write_seconds', 'Time storing one snapshot of vehicle positions')
+INGEST_VEHICLES = Counter('transit_ingest_vehicles_total', 'Vehicles handled by ingestion writes', ['result'])
+
+# Views
+VIEW_SECONDS = Histogram('transit_view_seconds', 'Time spent in transit views', ['view'])
+VIEW_REQUESTS = Counter('transit_view_requests_total', 'Requests handled by transit views', ['view', 'status'])
+VIEW_QUERIES = Histogram(
+    'transit_view_queries', 'Database queries per transit view request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+SERIALIZE_SECONDS = Histogram('transit_serialize_seconds', 'Time encoding response documents', ['document'])
+
+
+def render():
+    """All metrics, from every process in multiprocess mode, in the text exposition format"""
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run on the default connection; yields a one-item list"""
+    count = [0]
+
+    def wrapper(execute, sql, params, many, context):
+        count[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield count
+
+
+def _record_view(name, started, status, queries=None):
+    VIEW_SECONDS.labels(view=name).observe(time.perf_counter() - started)
+    VIEW_REQUESTS.labels(view=name, status=status).inc()
+    if queries is not None:
+        VIEW_QUERIES.labels(view=name).observe(queries)
+
+
+def instrument_view(view=None, *, name=None):
+    """Record duration, status and query count of a view.
+
+    Use as ``@instrument_view`` or, where the function name is not a useful
+    label, ``@instrument_view(name=...)``.
+    """
+    if view is None:
+        return functools.partial(instrument_view, name=name)
+    name = name or view.__name__
+
+    if asyncio.iscoroutinefunction(view):
+        # Queries of async views run on other threads and are not counted
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await view(request, *args, **kwargs)
+                status = response.status_code
+                return response
+            except Http404:
+                status = 404
+                raise
+            finally:
+                _record_view(name, started, status)
+        return wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        status = 500
+        with count_queries() as queries:
+            try:
+                response = view(request, *args, **kwargs)
+                status = response.status_code
+                return response
+            except Http404:
+                status = 404
+                raise
+            finally:
+                _record_view(name, started, status, queries[0])
+    return wrapper
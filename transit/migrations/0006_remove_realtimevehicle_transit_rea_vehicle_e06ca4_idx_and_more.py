@@ -0,0 +1,29 @@
+# Generated by Django 4.2.18 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0005_auto_20250128_1452'),
+    ]
+
+    operations = [
+        # Rows only ever hold the latest snapshot; clear them so duplicate
+        # vehicle_ids left by the old delete-and-insert path can't block the
+        # unique constraint. The next ingestion cycle repopulates the table.
+        migrations.RunSQL(
+            "DELETE FROM transit_realtimevehicle;",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveIndex(
+            model_name='realtimevehicle',
+            name='transit_rea_vehicle_e06ca4_idx',
+        ),
+        migrations.AlterField(
+            model_name='realtimevehicle',
+            name='vehicle_id',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.18 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0006_remove_realtimevehicle_transit_rea_vehicle_e06ca4_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehiclePosition',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('vehicle_id', models.CharField(max_length=255)),
+                ('trip_id', models.CharField(max_length=255)),
+                ('route_id', models.CharField(max_length=255)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('bearing', models.FloatField(null=True)),
+                ('speed', models.FloatField(null=True)),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'transit_vehicleposition',
+                'managed': False,
+            },
+        ),
+        # Partitioned tables need the partition key in the primary key, which
+        # Django can't express, so the parent table is created here. Daily
+        # partitions are added by transit.history.ensure_partitions.
+        migrations.RunSQL(
+            """
+            CREATE TABLE transit_vehicleposition (
+                id bigserial NOT NULL,
+                vehicle_id varchar(255) NOT NULL,
+                trip_id varchar(255) NOT NULL,
+                route_id varchar(255) NOT NULL,
+                latitude double precision NOT NULL,
+                longitude double precision NOT NULL,
+                bearing double precision NULL,
+                speed double precision NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                PRIMARY KEY (id, "timestamp")
+            ) PARTITION BY RANGE ("timestamp");
+            CREATE INDEX transit_veh_vehicle_ts_idx
+                ON transit_vehicleposition (vehicle_id, "timestamp");
+            CREATE INDEX transit_veh_route_ts_idx
+                ON transit_vehicleposition (route_id, "timestamp");
+            """,
+            "DROP TABLE transit_vehicleposition;",
+        ),
+    ]
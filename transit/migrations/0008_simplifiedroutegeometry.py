@@ -0,0 +1,27 @@
+# Generated by Django 4.2.18 on 2026-10-18 10:41
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0007_vehicleposition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimplifiedRouteGeometry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField()),
+                ('geometry', django.contrib.gis.db.models.fields.LineStringField(srid=4326)),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='simplified_geometries', to='transit.route')),
+            ],
+            options={
+                'unique_together': {('route', 'tolerance')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0008_simplifiedroutegeometry'),
+    ]
+
+    operations = [
+        # Django creates this index with the PointField, but databases that
+        # were loaded by hand may lack it; bbox queries on stops.json depend
+        # on it. Same name as Django's, so it is never created twice.
+        migrations.RunSQL(
+            "CREATE INDEX IF NOT EXISTS transit_stop_location_id "
+            "ON transit_stop USING GIST (location);",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0009_stop_location_gist_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routestop',
+            name='distance_along',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
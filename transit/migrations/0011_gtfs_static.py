@@ -0,0 +1,93 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:20
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0010_routestop_distance_along'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Calendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_id', models.CharField(max_length=255, unique=True)),
+                ('monday', models.BooleanField()),
+                ('tuesday', models.BooleanField()),
+                ('wednesday', models.BooleanField()),
+                ('thursday', models.BooleanField()),
+                ('friday', models.BooleanField()),
+                ('saturday', models.BooleanField()),
+                ('sunday', models.BooleanField()),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('content_hash', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FeedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=80, unique=True)),
+                ('sha256', models.CharField(max_length=64)),
+                ('rows', models.IntegerField(default=0)),
+                ('imported_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Shape',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shape_id', models.CharField(max_length=255, unique=True)),
+                ('geometry', django.contrib.gis.db.models.fields.LineStringField(srid=4326)),
+                ('content_hash', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trip_id', models.CharField(max_length=255, unique=True)),
+                ('route_id', models.CharField(db_index=True, max_length=80)),
+                ('service_id', models.CharField(db_index=True, max_length=255)),
+                ('shape_id', models.CharField(blank=True, max_length=255)),
+                ('headsign', models.CharField(blank=True, max_length=255)),
+                ('direction_id', models.SmallIntegerField(blank=True, null=True)),
+                ('content_hash', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CalendarDate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_id', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('exception_type', models.SmallIntegerField(choices=[(1, 'Service added'), (2, 'Service removed')])),
+                ('content_hash', models.CharField(max_length=32)),
+            ],
+            options={
+                'unique_together': {('service_id', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StopTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stop_id', models.CharField(db_index=True, max_length=50)),
+                ('stop_sequence', models.IntegerField()),
+                ('arrival_time', models.IntegerField(blank=True, null=True)),
+                ('departure_time', models.IntegerField(blank=True, null=True)),
+                ('content_hash', models.CharField(max_length=32)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stop_times', to='transit.trip')),
+            ],
+            options={
+                'ordering': ['trip', 'stop_sequence'],
+                'unique_together': {('trip', 'stop_sequence')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0011_gtfs_static'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stop',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0012_stop_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
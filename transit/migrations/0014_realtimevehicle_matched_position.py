@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit', '0013_route_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='realtimevehicle',
+            name='matched_latitude',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='realtimevehicle',
+            name='matched_longitude',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -9,10 +9,13 @@ class RealtimeVehicle(models.Model):
         ('IN_TRANSIT', 'In transit')
     ]
 
-    vehicle_id = models.CharField(max_length=255)
+    vehicle_id = models.CharField(max_length=255, unique=True)
     license_plate = models.CharField(max_length=255, blank=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    # Position snapped onto the route by transit.map_matching, null if unmatched
+    matched_latitude = models.FloatField(null=True)
+    matched_longitude = models.FloatField(null=True)
     bearing = models.FloatField(null=True)
     speed = models.FloatField(null=True)  # m/s
     timestamp = models.DateTimeField()
@@ -23,17 +26,38 @@ class RealtimeVehicle(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=['vehicle_id']),
             models.Index(fields=['trip_id']),
         ]
         ordering = ['-timestamp']
 
+class VehiclePosition(models.Model):
+    """Append-only history of vehicle positions.
+
+    The table is range-partitioned by day on ``timestamp`` in PostgreSQL, so
+    it is created in SQL (migration 0007) and its partitions are managed by
+    ``transit.history`` rather than by Django.
+    """
+    id = models.BigAutoField(primary_key=True)
+    vehicle_id = models.CharField(max_length=255)
+    trip_id = models.CharField(max_length=255)
+    route_id = models.CharField(max_length=255)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    bearing = models.FloatField(null=True)
+    speed = models.FloatField(null=True)  # m/s
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'transit_vehicleposition'
+
 class Stop(models.Model):
     code = models.CharField(max_length=50, unique=True)
     description = models.CharField(max_length=255)
     description_el = models.CharField(max_length=255)
     description_en = models.CharField(max_length=255)
     location = models.PointField(srid=4326)  # WGS84
+    content_hash = models.CharField(max_length=32, blank=True)  # Of the imported CSV row, see import_stops
 
     def __str__(self):
         return f"{self.code} - {self.description}"
@@ -51,6 +75,7 @@ class Route(models.Model):
     stops_list = models.TextField(blank=True)  # Comma-separated list from GTFS
     geometry = models.LineStringField(srid=4326)
     color = models.CharField(max_length=7, default='#666666')
+    content_hash = models.CharField(max_length=32, blank=True)  # Of the imported feature, see import_routes
     
     # Weekday schedule
     weekday_start = models.TimeField(null=True, blank=True)
@@ -78,10 +103,23 @@ class Route(models.Model):
     def __str__(self):
         return f"Route {self.route_id} - {self.line_name}"
 
+class SimplifiedRouteGeometry(models.Model):
+    """Route geometry simplified for display at lower zoom levels"""
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='simplified_geometries')
+    tolerance = models.FloatField()  # Degrees, see ROUTE_SIMPLIFY_TOLERANCES
+    geometry = models.LineStringField(srid=4326)
+
+    class Meta:
+        unique_together = [['route', 'tolerance']]
+
+    def __str__(self):
+        return f"{self.route} @ {self.tolerance}"
+
 class RouteStop(models.Model):
     route = models.ForeignKey(Route, on_delete=models.CASCADE)
     stop = models.ForeignKey(Stop, on_delete=models.CASCADE)
     sequence = models.IntegerField()  # Order of stops in the route
+    distance_along = models.FloatField(null=True, blank=True)  # Metres from the start of the route geometry
 
     class Meta:
         ordering = ['route', 'sequence']
@@ -92,3 +130,87 @@ class RouteStop(models.Model):
 
     def __str__(self):
         return f"{self.route} - Stop {self.sequence}: {self.stop}"
+
+
+# GTFS static schedule, loaded by import_gtfs (see transit.gtfs_static).
+# Rows carry a hash of their source columns so reimports only touch rows
+# that changed.
+
+class FeedFile(models.Model):
+    """Hash of each GTFS file as last imported; unchanged files are skipped"""
+    name = models.CharField(max_length=80, unique=True)
+    sha256 = models.CharField(max_length=64)
+    rows = models.IntegerField(default=0)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class Calendar(models.Model):
+    service_id = models.CharField(max_length=255, unique=True)
+    monday = models.BooleanField()
+    tuesday = models.BooleanField()
+    wednesday = models.BooleanField()
+    thursday = models.BooleanField()
+    friday = models.BooleanField()
+    saturday = models.BooleanField()
+    sunday = models.BooleanField()
+    start_date = models.DateField()
+    end_date = models.DateField()
+    content_hash = models.CharField(max_length=32)
+
+    def __str__(self):
+        return self.service_id
+
+class CalendarDate(models.Model):
+    EXCEPTION_TYPES = [
+        (1, 'Service added'),
+        (2, 'Service removed'),
+    ]
+
+    service_id = models.CharField(max_length=255)
+    date = models.DateField()
+    exception_type = models.SmallIntegerField(choices=EXCEPTION_TYPES)
+    content_hash = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = [['service_id', 'date']]
+
+    def __str__(self):
+        return f"{self.service_id} {self.date}"
+
+class Shape(models.Model):
+    shape_id = models.CharField(max_length=255, unique=True)
+    geometry = models.LineStringField(srid=4326)
+    content_hash = models.CharField(max_length=32)
+
+    def __str__(self):
+        return self.shape_id
+
+class Trip(models.Model):
+    trip_id = models.CharField(max_length=255, unique=True)
+    route_id = models.CharField(max_length=80, db_index=True)  # GTFS route_id, see Route.route_id
+    service_id = models.CharField(max_length=255, db_index=True)
+    shape_id = models.CharField(max_length=255, blank=True)
+    headsign = models.CharField(max_length=255, blank=True)
+    direction_id = models.SmallIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=32)
+
+    def __str__(self):
+        return self.trip_id
+
+class StopTime(models.Model):
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='stop_times')
+    stop_id = models.CharField(max_length=50, db_index=True)  # GTFS stop_id, see Stop.code
+    stop_sequence = models.IntegerField()
+    # Seconds after midnight of the service day; GTFS times may pass 24:00
+    arrival_time = models.IntegerField(null=True, blank=True)
+    departure_time = models.IntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=32)
+
+    class Meta:
+        ordering = ['trip', 'stop_sequence']
+        unique_together = [['trip', 'stop_sequence']]
+
+    def __str__(self):
+        return f"{self.trip} - {self.stop_sequence}: {self.stop_id}"
@@ -0,0 +1,129 @@
+"""
+Caching of documents derived from the static network (stops, routes and
+route stops).
+
+Derived documents are keyed by a network version that is bumped whenever
+network data changes (see transit.signals and the import commands), so a
+stale document is never served and nothing has to enumerate cache keys to
+invalidate them; superseded versions simply expire after
+NETWORK_DOCUMENT_TIMEOUT. Documents are stored pre-encoded with gzip and
+brotli alongside a strong ETag.
+"""
+import functools
+import gzip
+import hashlib
+import threading
+import time
+
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+VERSION_KEY = 'network:version'
+
+# Preferred first when the client accepts several
+ENCODINGS = ('br', 'gzip')
+
+# Per thread, like the connections whose transactions they follow:
+# invalidations requested, and the last request an invalidation covered
+_requests = threading.local()
+
+
+def version():
+    """Current network version"""
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        # Seeded from the clock so a lost counter never reuses old keys
+        cache.add(VERSION_KEY, int(time.time()), timeout=None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def invalidate():
+    """Mark every document derived from network data as stale"""
+    cache.add(VERSION_KEY, int(time.time()), timeout=None)
+    cache.incr(VERSION_KEY)
+
+
+def invalidate_on_commit():
+    """Invalidate once the current transaction commits, however often it is called.
+
+    Imports and signal receivers call this per row; every call queues a
+    callback, but only the first to run after a commit invalidates. Outside
+    a transaction it runs now.
+    """
+    _requests.count = getattr(_requests, 'count', 0) + 1
+    transaction.on_commit(functools.partial(_invalidate_requested, _requests.count))
+
+
+def _invalidate_requested(request):
+    # A commit runs its transaction's callbacks in order: the first covers
+    # every request made so far, the rest find nothing left to do. Callbacks
+    # of a rolled-back transaction never run, so later requests still count.
+    if request > getattr(_requests, 'done', 0):
+        _requests.done = _requests.count
+        invalidate()
+
+
+def get_or_build(name, build, timeout=None):
+    """Return the cached value for `name` at the current network version.
+
+    `build` is called on a miss and its result stored for `timeout` seconds,
+    NETWORK_DOCUMENT_TIMEOUT by default. Invalidation makes it unreachable
+    straight away; the timeout only bounds how long it occupies the cache.
+    """
+    key = f'network:{version()}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout=timeout or settings.NETWORK_DOCUMENT_TIMEOUT)
+    return value
+
+
+def encode_document(content):
+    """Precompute the compressed variants and ETag for a document body"""
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    return {
+        'etag': digest,
+        'identity': content,
+        'gzip': gzip.compress(content, compresslevel=9),
+        'br': brotli.compress(content),
+    }
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.partition(';')
+        name, _, value = params.partition('=')
+        try:
+            quality = float(value) if name.strip() == 'q' else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def document_response(request, document, content_type):
+    """Serve an encoded document, honouring Accept-Encoding and If-None-Match"""
+    accepted = _accepted_encodings(request)
+    encoding = next((e for e in ENCODINGS if e in document and e in accepted), None)
+
+    # Each encoding is a different representation, so it gets its own tag
+    etag = f'"{document["etag"]}-{encoding}"' if encoding else f'"{document["etag"]}"'
+    if_none_match = {tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')}
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(document[encoding or 'identity'], content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'  # Always revalidate; 304s are cheap
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,169 @@
+"""
+Opt-in profiling of individual requests in production.
+
+ProfilingMiddleware profiles a random PROFILING_SAMPLE_RATE fraction of
+requests, and any request carrying a valid signed token in the
+PROFILING_HEADER header (issue one with ``manage.py profiling_token``). Each
+profiled request records a cProfile profile of the view and the SQL it ran
+with per-query timings; query parameters are not kept. Async views pass
+through unprofiled.
+
+The last PROFILING_MAX_PROFILES profiles are kept in the cache as a ring
+buffer: a shared counter numbers profiles and each one overwrites the slot
+its number maps to, so storage stays bounded without any cleanup. Staff can
+browse them under /admin/profiles/ and download the raw stats for pstats or
+snakeviz.
+"""
+import asyncio
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+COUNTER_KEY = 'profiling:next'
+SUMMARY_KEY = 'profiling:summary:{}'
+PROFILE_KEY = 'profiling:profile:{}'
+
+SIGNING_SALT = 'transit.profiling'
+
+# Functions listed in the stored report, by cumulative time
+REPORT_LINES = 60
+
+# Queries recorded per request; the rest are only counted
+MAX_QUERIES = 1000
+
+
+def make_token():
+    """A header value that enables profiling for PROFILING_TOKEN_MAX_AGE seconds"""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def is_valid_token(token):
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def should_profile(request):
+    # Browsing profiles should not evict them
+    if request.path_info.startswith('/admin/'):
+        return False
+    token = request.headers.get(settings.PROFILING_HEADER)
+    if token and is_valid_token(token):
+        return True
+    return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+class QueryRecorder:
+    """Database execute wrapper recording each query's SQL and duration"""
+
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.time += duration
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({'sql': sql, 'many': many, 'duration': duration})
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Profiles the view call from process_view, so the middleware works under
+    both WSGI and ASGI. Async views are not profiled: cProfile only follows
+    the thread it was enabled on, not coroutines suspended across awaits.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if asyncio.iscoroutinefunction(view_func) or not should_profile(request):
+            return None
+
+        profiler = cProfile.Profile()
+        recorder = QueryRecorder()
+        try:
+            profiler.enable()
+        except ValueError:  # Another profiler is already active on this thread
+            return None
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                response = view_func(request, *view_args, **view_kwargs)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+
+        profile_id = store_profile(request, response, profiler, recorder, started_at, duration)
+        response['X-Profile-Id'] = str(profile_id)
+        return response
+
+
+def _next_id():
+    cache.add(COUNTER_KEY, 0, timeout=None)
+    return cache.incr(COUNTER_KEY)
+
+
+def store_profile(request, response, profiler, recorder, started_at, duration):
+    """Store a finished profile in its ring buffer slot; returns its id"""
+    profile_id = _next_id()
+    slot = profile_id % settings.PROFILING_MAX_PROFILES
+
+    report = io.StringIO()
+    # Stats takes the profiler's data over, so it is serialised from here
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+
+    summary = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'started_at': started_at,
+        'duration': duration,
+        'query_count': recorder.count,
+        'query_time': recorder.time,
+    }
+    # Listing reads only the small summaries; the profile itself is fetched on demand
+    cache.set_many({
+        SUMMARY_KEY.format(slot): summary,
+        PROFILE_KEY.format(slot): {
+            **summary,
+            'report': report.getvalue(),
+            'queries': recorder.queries,
+            # The format pstats.Stats and snakeviz load from a file
+            'stats': marshal.dumps(stats.stats),
+        },
+    }, timeout=None)
+    return profile_id
+
+
+def get_profiles():
+    """Summaries of the stored profiles, newest first"""
+    keys = [SUMMARY_KEY.format(slot) for slot in range(settings.PROFILING_MAX_PROFILES)]
+    return sorted(cache.get_many(keys).values(), key=lambda summary: summary['id'], reverse=True)
+
+
+def get_profile(profile_id):
+    """A stored profile, or None once its slot has been reused"""
+    profile = cache.get(PROFILE_KEY.format(profile_id % settings.PROFILING_MAX_PROFILES))
+    if profile is None or profile['id'] != profile_id:
+        return None
+    return profile
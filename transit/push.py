@@ -0,0 +1,169 @@
+"""
+In-process fan-out of realtime snapshots to Server-Sent Events clients.
+
+One broadcaster per worker watches the shared feed cache and, whenever a new
+snapshot version appears, encodes its delta once and hands it to every
+connected stream. Subscriptions filtered by route or bounding box re-encode
+only their own subset. Requires serving the project over ASGI.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import feed_cache
+
+
+# Payloads read deltas from the shared cache; a slow cache round-trip must
+# not block the event loop every stream in the worker runs on
+snapshot_payload = sync_to_async(feed_cache.snapshot_payload, thread_sensitive=False)
+
+
+def encode_event(payload):
+    """Format a positions payload as an SSE ``vehicles`` event"""
+    data = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return f"id: {payload['version']}\nevent: vehicles\ndata: {data}\n\n"
+
+
+class Subscription:
+    """A single connected stream and the vehicles it is allowed to see"""
+
+    def __init__(self, routes=None, bbox=None, since=None):
+        self.routes = set(routes) if routes else None
+        self.bbox = bbox
+        # Version a reconnecting client already has (SSE Last-Event-ID)
+        self.since = since
+        self.visible = set()
+        self.pending = None
+        self.ready = asyncio.Event()
+
+    @property
+    def filtered(self):
+        return self.routes is not None or self.bbox is not None
+
+    def matches(self, vehicle):
+        if self.routes is not None and vehicle['route'] not in self.routes:
+            return False
+        if self.bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            if not (min_lon <= vehicle['lon'] <= max_lon and min_lat <= vehicle['lat'] <= max_lat):
+                return False
+        return True
+
+    def push(self, payload, event):
+        # A stream that hasn't consumed the previous delta would miss it, so
+        # fall back to the full snapshot (payload None) to resync.
+        if self.pending is not None:
+            payload, event = None, None
+        self.pending = (payload, event)
+        self.ready.set()
+
+    async def next_event(self, broadcaster, timeout):
+        """Wait for the next event to send, or None on keepalive timeout"""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.ready.clear()
+        payload, event = self.pending
+        self.pending = None
+
+        if payload is None:
+            since, self.since = self.since, None
+            if since is None and not self.filtered:
+                return broadcaster.full_event()
+            payload = await snapshot_payload(broadcaster.snapshot, since)
+            if payload['full']:
+                self.visible = set()
+        elif not self.filtered:
+            return event
+        return encode_event(self.filter(payload) if self.filtered else payload)
+
+    def filter(self, payload):
+        vehicles = [v for v in payload['vehicles'] if self.matches(v)]
+        matching = {v['vehicle_id'] for v in vehicles}
+
+        if payload['full']:
+            self.visible = matching
+            return dict(payload, vehicles=vehicles)
+
+        # Vehicles that moved out of the filter are removed for this stream
+        left = {v['vehicle_id'] for v in payload['vehicles']} - matching
+        removed = (set(payload['removed']) | left) & self.visible
+        self.visible = (self.visible - removed) | matching
+        return dict(payload, vehicles=vehicles, removed=sorted(removed))
+
+
+class Broadcaster:
+    """Watches the shared snapshot and fans new versions out to subscriptions"""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.snapshot = None
+        self.task = None
+        self._full_event = None
+
+    def subscribe(self, subscription):
+        self.subscriptions.add(subscription)
+        if self.snapshot is not None:
+            subscription.push(None, None)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def full_event(self):
+        if self._full_event is None:
+            # A full payload is built from the snapshot alone, without cache reads
+            self._full_event = encode_event(feed_cache.snapshot_payload(self.snapshot))
+        return self._full_event
+
+    async def run(self):
+        get_snapshot = sync_to_async(feed_cache.get_snapshot, thread_sensitive=False)
+        while self.subscriptions:
+            try:
+                snapshot = await get_snapshot()
+            except Exception:
+                snapshot = None
+
+            if snapshot is not None and (
+                self.snapshot is None or snapshot['version'] != self.snapshot['version']
+            ):
+                previous = self.snapshot
+                self.snapshot = snapshot
+                self._full_event = None
+                if previous is None:
+                    for subscription in self.subscriptions:
+                        subscription.push(None, None)
+                else:
+                    payload = await snapshot_payload(snapshot, previous['version'])
+                    event = encode_event(payload)
+                    for subscription in self.subscriptions:
+                        subscription.push(payload, event)
+
+            await asyncio.sleep(settings.REALTIME_PUSH_CHECK_INTERVAL)
+
+
+broadcaster = Broadcaster()
+
+
+async def stream_events(subscription):
+    """Yield SSE events for one client until the stream's lifetime runs out.
+
+    Streams are closed after REALTIME_STREAM_MAX_AGE so subscriptions of
+    clients that silently went away don't pile up; EventSource reconnects
+    on its own and resumes from the last event id.
+    """
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + settings.REALTIME_STREAM_MAX_AGE
+    broadcaster.subscribe(subscription)
+    try:
+        yield "retry: 2000\n\n"
+        while loop.time() < closes_at:
+            event = await subscription.next_event(broadcaster, settings.REALTIME_STREAM_KEEPALIVE)
+            yield event if event is not None else ": keepalive\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,201 @@
+"""
+Precomputed per-stop schedule index for static departure lookups.
+
+Built from the GTFS static tables after import_gtfs and saved with NumPy to
+SCHEDULE_INDEX_PATH. Departures are stored as one sorted array of times per
+(stop, service) pair, together with the calendar, so answering "next
+departures at this stop" needs neither the database nor a scan: the active
+services for the day are resolved from the calendar and each one's array is
+bisected. Workers load the file on first use and reload it when it changes.
+"""
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from django.conf import settings
+from django.db.models.functions import Coalesce
+
+from .models import Calendar, CalendarDate, StopTime, Trip
+
+DAY = 86400
+
+# Bit per weekday, Monday first, matching date.weekday()
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def build_schedule_index(path=None):
+    """Build the index from the database and save it; returns departures indexed"""
+    path = path or settings.SCHEDULE_INDEX_PATH
+
+    trips = list(Trip.objects.order_by('id').values_list('id', 'trip_id', 'route_id', 'headsign', 'service_id'))
+    trip_rows = {trip[0]: row for row, trip in enumerate(trips)}
+    services = sorted({trip[4] for trip in trips})
+    service_rows = {service_id: row for row, service_id in enumerate(services)}
+
+    stop_ids, times, trip_index = [], [], []
+    stop_times = StopTime.objects.annotate(
+        time=Coalesce('departure_time', 'arrival_time')
+    ).filter(time__isnull=False).values_list('stop_id', 'time', 'trip_id')
+    for stop_id, time, trip_pk in stop_times.iterator(chunk_size=10000):
+        stop_ids.append(stop_id)
+        times.append(time)
+        trip_index.append(trip_rows[trip_pk])
+
+    stops, stop_index = np.unique(np.array(stop_ids, dtype=str), return_inverse=True)
+    times = np.array(times, dtype=np.int32)
+    trip_index = np.array(trip_index, dtype=np.int32)
+    service_index = np.array([service_rows[trips[row][4]] for row in trip_index], dtype=np.int32)
+
+    # Sort by stop, then service, then time; each (stop, service) group is
+    # then a contiguous, sorted slice
+    order = np.lexsort((times, service_index, stop_index))
+    stop_index, service_index = stop_index[order], service_index[order]
+    times, trip_index = times[order], trip_index[order]
+    if len(times):
+        starts = np.flatnonzero(np.r_[True, (np.diff(stop_index) != 0) | (np.diff(service_index) != 0)])
+    else:
+        starts = np.array([], dtype=np.int64)
+
+    calendars = list(Calendar.objects.filter(service_id__in=services).values_list(
+        'service_id', *WEEKDAYS, 'start_date', 'end_date'
+    ))
+    exceptions = list(CalendarDate.objects.filter(service_id__in=services).values_list(
+        'service_id', 'date', 'exception_type'
+    ))
+
+    # Written aside and renamed, so workers never load a half-written file
+    partial = path.with_name(path.name + '.partial')
+    with open(partial, 'wb') as f:
+        np.savez(
+            f,
+            stops=stops,
+            services=np.array(services, dtype=str),
+            trip_ids=np.array([trip[1] for trip in trips], dtype=str),
+            trip_routes=np.array([trip[2] for trip in trips], dtype=str),
+            trip_headsigns=np.array([trip[3] for trip in trips], dtype=str),
+            group_stops=stop_index[starts].astype(np.int32),
+            group_services=service_index[starts].astype(np.int32),
+            group_starts=starts.astype(np.int64),
+            times=times,
+            trips=trip_index,
+            calendar_services=np.array([service_rows[c[0]] for c in calendars], dtype=np.int32),
+            calendar_days=np.array([sum(1 << i for i, running in enumerate(c[1:8]) if running) for c in calendars],
+                                   dtype=np.int8),
+            calendar_starts=np.array([c[8].toordinal() for c in calendars], dtype=np.int32),
+            calendar_ends=np.array([c[9].toordinal() for c in calendars], dtype=np.int32),
+            exception_services=np.array([service_rows[e[0]] for e in exceptions], dtype=np.int32),
+            exception_dates=np.array([e[1].toordinal() for e in exceptions], dtype=np.int32),
+            exception_types=np.array([e[2] for e in exceptions], dtype=np.int8),
+        )
+    os.replace(partial, path)
+    return len(times)
+
+
+class ScheduleIndex:
+    """The saved index, with its groups keyed for lookups"""
+
+    def __init__(self, data):
+        self.trip_ids = data['trip_ids']
+        self.trip_routes = data['trip_routes']
+        self.trip_headsigns = data['trip_headsigns']
+        self.times = data['times']
+        self.trips = data['trips']
+
+        ends = np.r_[data['group_starts'][1:], len(self.times)]
+        stops = data['stops']
+        self.groups = {}  # stop_id -> {service row: (start, end)}
+        groups = zip(data['group_stops'], data['group_services'], data['group_starts'], ends)
+        for stop, service, start, end in groups:
+            self.groups.setdefault(str(stops[stop]), {})[int(service)] = (int(start), int(end))
+
+        self.calendar = {
+            int(service): (int(days), int(start), int(end))
+            for service, days, start, end in zip(
+                data['calendar_services'], data['calendar_days'], data['calendar_starts'], data['calendar_ends']
+            )
+        }
+        self.exceptions = {
+            (int(service), int(date)): int(kind)
+            for service, date, kind in zip(
+                data['exception_services'], data['exception_dates'], data['exception_types']
+            )
+        }
+        self._services_by_day = {}
+
+    def services_on(self, day):
+        """Service rows running on `day`, honouring calendar_dates exceptions"""
+        ordinal = day.toordinal()
+        if ordinal in self._services_by_day:
+            return self._services_by_day[ordinal]
+
+        running = set()
+        for service, (days, start, end) in self.calendar.items():
+            if start <= ordinal <= end and days & (1 << day.weekday()):
+                running.add(service)
+        for (service, date), kind in self.exceptions.items():
+            if date == ordinal:
+                if kind == 1:
+                    running.add(service)
+                else:
+                    running.discard(service)
+        self._services_by_day[ordinal] = running
+        return running
+
+    def next_departures(self, stop_id, moment, limit):
+        """The next `limit` scheduled departures at or after `moment` (aware datetime)"""
+        groups = self.groups.get(stop_id)
+        if not groups:
+            return []
+
+        local = moment.astimezone(ZoneInfo(settings.GTFS_TIMEZONE))
+        today = local.date()
+        seconds = local.hour * 3600 + local.minute * 60 + local.second
+
+        # Trips of yesterday's service day may run past midnight (times >= 24:00)
+        candidates = []
+        for day, offset in ((today - timedelta(days=1), DAY), (today, 0)):
+            midnight = datetime.combine(day, datetime.min.time(), tzinfo=local.tzinfo)
+            for service in self.services_on(day) & groups.keys():
+                start, end = groups[service]
+                times = self.times[start:end]
+                first = start + int(np.searchsorted(times, seconds + offset))
+                candidates.append([
+                    (int(self.times[i]) - offset, midnight, i)
+                    for i in range(first, min(first + limit, end))
+                ])
+
+        departures = []
+        for time, midnight, i in heapq.merge(*candidates, key=lambda candidate: candidate[0]):
+            if len(departures) == limit:
+                break
+            trip = self.trips[i]
+            departures.append({
+                'time': (midnight + timedelta(seconds=int(self.times[i]))).isoformat(),
+                'route_id': str(self.trip_routes[trip]),
+                'trip_id': str(self.trip_ids[trip]),
+                'headsign': str(self.trip_headsigns[trip]),
+            })
+        return departures
+
+
+_lock = threading.Lock()
+_loaded = {'mtime': None, 'index': None}
+
+
+def get_index():
+    """The saved schedule index, or None if it has not been built"""
+    path = settings.SCHEDULE_INDEX_PATH
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if _loaded['mtime'] != mtime:
+        with _lock:
+            if _loaded['mtime'] != mtime:
+                with np.load(path) as data:
+                    _loaded['index'] = ScheduleIndex(data)
+                _loaded['mtime'] = mtime
+    return _loaded['index']
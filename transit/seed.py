@@ -0,0 +1,67 @@
+"""
+Synthetic network and feed data for the tests and the benchmark command.
+
+Seeding writes real rows; only ever seed a test database.
+"""
+import random
+
+from django.contrib.gis.geos import LineString, Point
+from google.transit import gtfs_realtime_pb2
+
+from .models import Route, RouteStop, Stop
+
+SEED_PREFIX = 'seed-'
+
+
+def seed_network(stop_count, route_count, stops_per_route):
+    """Create a grid of stops and zig-zag routes; returns (stops, routes, route stops)"""
+    stops = Stop.objects.bulk_create([
+        Stop(
+            code=f'{SEED_PREFIX}{i}',
+            description=f'Stop {i}',
+            description_el=f'Στάση {i}',
+            description_en=f'Stop {i}',
+            location=Point(32.3 + (i % 100) * 0.02, 34.6 + (i // 100) * 0.01, srid=4326),
+        )
+        for i in range(stop_count)
+    ])
+    routes = Route.objects.bulk_create([
+        Route(
+            route_id=f'{SEED_PREFIX}{i}',
+            line_name=f'{i}',
+            geometry=LineString(
+                [(32.3 + j * 0.005, 34.6 + (i % 50) * 0.02 + (j % 3) * 0.001) for j in range(200)],
+                srid=4326
+            ),
+        )
+        for i in range(route_count)
+    ])
+    route_stops = RouteStop.objects.bulk_create([
+        RouteStop(route=route, stop=stops[(r * stops_per_route + j) % len(stops)], sequence=j + 1)
+        for r, route in enumerate(routes)
+        for j in range(min(stops_per_route, len(stops)))
+    ])
+    return stops, routes, route_stops
+
+
+def seed_feed(template, count, routes, seed=0):
+    """A FeedMessage of `count` vehicles cloned from `template`'s vehicle entities.
+
+    Each clone gets a unique id and is placed near a random vertex of one of
+    `routes`, so map matching and arrival estimates see realistic input.
+    """
+    rng = random.Random(seed)
+    vehicles = [entity for entity in template.entity if entity.HasField('vehicle')]
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.CopyFrom(template.header)
+    for i in range(count):
+        route = routes[i % len(routes)]
+        lon, lat = rng.choice(route.geometry.coords)
+        entity = feed.entity.add()
+        entity.CopyFrom(vehicles[i % len(vehicles)])
+        entity.id = f'{SEED_PREFIX}{i}'
+        entity.vehicle.vehicle.id = f'{SEED_PREFIX}{i}'
+        entity.vehicle.trip.route_id = route.route_id
+        entity.vehicle.position.longitude = lon + rng.uniform(-0.0002, 0.0002)
+        entity.vehicle.position.latitude = lat + rng.uniform(-0.0002, 0.0002)
+    return feed
@@ -1,23 +1,87 @@
+import time
+from datetime import datetime, timezone as dt_timezone
 from django.utils import timezone
+from transit import metrics
+from transit.map_matching import match_vehicles
 from transit.models import RealtimeVehicle
 from google.transit import gtfs_realtime_pb2
 import requests
 
-def fetch_realtime_data(url):
-    """Fetch and parse GTFS-RT data"""
+def fetch_feed_content(url, timeout=5, session=None):
+    """Fetch raw GTFS-RT bytes, optionally over a pooled requests session"""
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        
-        feed = gtfs_realtime_pb2.FeedMessage()
-        feed.ParseFromString(response.content)
-        return feed
-        
+        with metrics.FEED_FETCH_SECONDS.time():
+            response = (session or requests).get(url, timeout=timeout)
+            response.raise_for_status()
+        metrics.FEED_FETCH_BYTES.inc(len(response.content))
+        return response.content
+
     except Exception as e:
+        metrics.FEED_FETCH_ERRORS.inc()
         raise RuntimeError(f"GTFS-RT fetch failed: {str(e)}")
 
+def parse_feed(content):
+    """Parse raw GTFS-RT bytes into a FeedMessage"""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    with metrics.FEED_PARSE_SECONDS.time():
+        feed.ParseFromString(content)
+
+    counts = {'vehicle': 0, 'trip_update': 0, 'alert': 0}
+    for entity in feed.entity:
+        for kind in counts:
+            if entity.HasField(kind):
+                counts[kind] += 1
+    for kind, count in counts.items():
+        metrics.FEED_ENTITIES.labels(kind=kind).set(count)
+    metrics.FEED_TIMESTAMP.set(feed.header.timestamp)
+    return feed
+
+def fetch_realtime_data(url):
+    """Fetch and parse GTFS-RT data"""
+    return parse_feed(fetch_feed_content(url))
+
+def serialize_vehicle_positions(feed, updated=None, positions=None):
+    """Convert feed vehicle entities into the JSON shape served to the map.
+
+    ``lat``/``lon`` are the raw GPS fix and ``matched_lat``/``matched_lon``
+    the point snapped onto the route; stop progress comes from map matching
+    where the vehicle was matched, as in the stored rows. Pass `positions`
+    when the feed has already been through process_vehicle_positions.
+    """
+    updated = updated or timezone.now().isoformat()
+    if positions is None:
+        positions = process_vehicle_positions(feed)
+    statuses = gtfs_realtime_pb2.VehiclePosition.VehicleStopStatus
+    entities = (entity for entity in feed.entity if entity.HasField('vehicle'))
+    vehicles = []
+    for entity, position in zip(entities, positions):
+        v = entity.vehicle
+        if position.distance_along is not None:
+            current_stop_sequence = position.current_stop_sequence
+            current_status = statuses.Value(position.current_status)
+        else:
+            current_stop_sequence = v.current_stop_sequence if v.HasField('current_stop_sequence') else None
+            current_status = v.current_status if v.HasField('current_status') else None
+
+        vehicles.append({
+            'vehicle_id': v.vehicle.id,
+            'lat': v.position.latitude,
+            'lon': v.position.longitude,
+            'matched_lat': position.matched_latitude,
+            'matched_lon': position.matched_longitude,
+            'bearing': v.position.bearing,
+            'speed': (v.position.speed * 3.6) if v.position.speed else 0,
+            'route': v.trip.route_id,
+            'current_stop_sequence': current_stop_sequence,
+            'current_status': current_status,
+            'updated': updated
+        })
+    return vehicles
+
 def process_vehicle_positions(feed):
-    """Process feed entities into RealtimeVehicle objects"""
+    """Process feed entities into map-matched RealtimeVehicle objects"""
+    started = time.perf_counter()
+    statuses = gtfs_realtime_pb2.VehiclePosition.VehicleStopStatus
     positions = []
     for entity in feed.entity:
         if entity.HasField('vehicle'):
@@ -30,11 +94,20 @@ def process_vehicle_positions(feed):
                     longitude=vp.position.longitude,
                     bearing=vp.position.bearing,
                     speed=vp.position.speed,
-                    timestamp=timezone.make_aware(timezone.datetime.fromtimestamp(vp.timestamp)),
+                    timestamp=datetime.fromtimestamp(vp.timestamp, tz=dt_timezone.utc),
                     route_id=vp.trip.route_id,
                     trip_id=vp.trip.trip_id,
-                    current_status='IN_TRANSIT',  # Default status
-                    current_stop_sequence=0  # Default sequence
+                    # Feed values, where given, stand for vehicles that can't be matched
+                    current_status=(
+                        statuses.Name(vp.current_status) if vp.HasField('current_status') else 'IN_TRANSIT'
+                    ),
+                    current_stop_sequence=vp.current_stop_sequence
                 )
             )
-    return positions
\ No newline at end of file
+    match_vehicles(positions)
+
+    metrics.PROCESS_SECONDS.observe(time.perf_counter() - started)
+    matched = sum(1 for position in positions if position.distance_along is not None)
+    metrics.VEHICLES.labels(matched='true').set(matched)
+    metrics.VEHICLES.labels(matched='false').set(len(positions) - matched)
+    return positions
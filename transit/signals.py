@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+
+from . import network_cache
+from .models import Route, RouteStop, Stop
+
+NETWORK_MODELS = [Stop, Route, RouteStop]
+
+
+def invalidate_network_cache(sender, **kwargs):
+    """Drop documents derived from the network when any of its rows change"""
+    # After commit, so a rebuild can't cache data from an unfinished import
+    network_cache.invalidate_on_commit()
+
+
+def connect():
+    for model in NETWORK_MODELS:
+        post_save.connect(invalidate_network_cache, sender=model)
+        post_delete.connect(invalidate_network_cache, sender=model)
+
+
+def disconnect():
+    for model in NETWORK_MODELS:
+        post_save.disconnect(invalidate_network_cache, sender=model)
+        post_delete.disconnect(invalidate_network_cache, sender=model)
+
+
+@contextmanager
+def muted():
+    """Disconnect the receivers for a bulk import, which invalidates once itself.
+
+    Delete receivers make Django fetch every row and send a signal per row
+    instead of issuing one DELETE. Receivers are process-wide, so only use
+    this from management commands.
+    """
+    disconnect()
+    try:
+        yield
+    finally:
+        connect()
+
+
+connect()
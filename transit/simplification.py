@@ -0,0 +1,49 @@
+"""
+Zoom-dependent route geometry simplification.
+
+Each route is simplified once per tolerance in ROUTE_SIMPLIFY_TOLERANCES
+(degrees) with GEOS' topology-preserving Douglas-Peucker, and endpoints pick
+the coarsest level whose error stays under one screen pixel at the
+requested zoom.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from . import network_cache
+from .models import Route, SimplifiedRouteGeometry
+
+# Degrees of longitude covered by one 256px web-mercator tile at zoom 0
+TILE_DEGREES = 360.0
+
+# Requested zooms are clamped to the range web maps use
+MAX_ZOOM = 24
+
+
+def tolerance_for_zoom(zoom):
+    """The coarsest simplification that is invisible at `zoom`, or None for full detail"""
+    zoom = min(max(zoom, 0), MAX_ZOOM)
+    pixel_degrees = TILE_DEGREES / (256 * 2 ** zoom)
+    return nearest_tolerance(pixel_degrees)
+
+
+def nearest_tolerance(tolerance):
+    """The largest configured tolerance not exceeding `tolerance`, or None"""
+    candidates = [t for t in settings.ROUTE_SIMPLIFY_TOLERANCES if t <= tolerance]
+    return max(candidates) if candidates else None
+
+
+def build_simplified_geometries():
+    """Recompute every simplified level for every route; returns rows written"""
+    levels = []
+    for route in Route.objects.only('id', 'geometry').iterator():
+        for tolerance in settings.ROUTE_SIMPLIFY_TOLERANCES:
+            geometry = route.geometry.simplify(tolerance, preserve_topology=True)
+            if geometry.geom_type != 'LineString' or geometry.num_points < 2:
+                continue
+            levels.append(SimplifiedRouteGeometry(route_id=route.id, tolerance=tolerance, geometry=geometry))
+
+    with transaction.atomic():
+        SimplifiedRouteGeometry.objects.all().delete()
+        SimplifiedRouteGeometry.objects.bulk_create(levels, batch_size=500)
+        network_cache.invalidate_on_commit()
+    return len(levels)
@@ -0,0 +1,544 @@
+import json
+import math
+import struct
+import tempfile
+import time
+from datetime import date, datetime
+from pathlib import Path
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from google.transit import gtfs_realtime_pb2
+
+from . import departures, feed_cache, profiling, wire_formats
+from .linear_referencing import EARTH_RADIUS, RouteLine, RouteNetwork
+from .map_matching import match_vehicles
+from .models import Calendar, CalendarDate, RealtimeVehicle, StopTime, Trip
+from .schedule_index import ScheduleIndex, build_schedule_index
+from .seed import SEED_PREFIX, seed_network
+
+# Tests never touch the cache shared with running workers
+TEST_SETTINGS = {
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'transit-tests',
+        }
+    },
+}
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryBudgetTests(TestCase):
+    """Read endpoints run in a fixed number of queries, however large the network"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Large enough for N+1 patterns to show up as hundreds of queries
+        seed_network(stop_count=500, route_count=20, stops_per_route=40)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertQueries(self, count, url_name, *args, **params):
+        """Request an endpoint, checking its query count and build time"""
+        with self.assertNumQueries(count):
+            started = time.perf_counter()
+            response = self.client.get(reverse(url_name, args=args), params)
+            elapsed = (time.perf_counter() - started) * 1000
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(elapsed, settings.RESPONSE_BUDGET_MS, f'{url_name} took {elapsed:.1f} ms')
+        return response
+
+    def test_stops(self):
+        self.assertQueries(1, 'transit:stops-json')
+
+    def test_stops_by_route(self):
+        response = self.assertQueries(1, 'transit:stops-json', route_id=f'{SEED_PREFIX}0')
+        self.assertEqual(len(response.json()['stops']), 40)
+
+    def test_stops_by_bbox(self):
+        min_lon, min_lat, max_lon, max_lat = 33.01, 34.5, 33.99, 35.5
+        response = self.assertQueries(
+            1, 'transit:stops-json', bbox=f'{min_lon},{min_lat},{max_lon},{max_lat}', limit=500
+        )
+        stops = response.json()['stops']
+        # 49 of the 100 grid columns, in each of the 5 rows
+        self.assertEqual(len(stops), 245)
+        for stop in stops:
+            self.assertTrue(min_lon <= stop['lon'] <= max_lon and min_lat <= stop['lat'] <= max_lat, stop)
+
+    def test_stops_nearby(self):
+        response = self.assertQueries(2, 'transit:stops-nearby', lat=34.7, lon=32.5, k=10, radius=5000)
+        self.assertTrue(response.json()['stops'])
+
+    def test_routes_geojson(self):
+        self.assertQueries(2, 'transit:routes-geojson')
+        self.assertQueries(0, 'transit:routes-geojson')
+
+    def test_routes_geojson_simplified(self):
+        self.assertQueries(3, 'transit:routes-geojson', zoom=9)
+        self.assertQueries(0, 'transit:routes-geojson', zoom=9)
+
+    def test_vector_tile(self):
+        self.assertQueries(1, 'transit:vector-tile', 10, 604, 406)
+        self.assertQueries(0, 'transit:vector-tile', 10, 604, 406)
+
+    def test_stop_arrivals(self):
+        self.assertQueries(1, 'transit:stop-arrivals', f'{SEED_PREFIX}0')
+
+    def test_stop_departures(self):
+        self.assertQueries(0, 'transit:stop-departures', f'{SEED_PREFIX}0')
+
+
+def plain_view(request):
+    return HttpResponse('ok')
+
+
+async def async_view(request):
+    return HttpResponse('ok')
+
+
+@override_settings(**TEST_SETTINGS, PROFILING_SAMPLE_RATE=0.0, PROFILING_MAX_PROFILES=3,
+                   PROFILING_TOKEN_MAX_AGE=60)
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.middleware = profiling.ProfilingMiddleware(lambda request: HttpResponse())
+
+    def request(self, token=None):
+        headers = {'HTTP_X_PROFILE': token} if token else {}
+        return RequestFactory().get('/stops.json', **headers)
+
+    def profile(self, view=plain_view, token=None):
+        return self.middleware.process_view(self.request(token), view, (), {})
+
+    def test_valid_token(self):
+        self.assertTrue(profiling.is_valid_token(profiling.make_token()))
+        self.assertTrue(profiling.should_profile(self.request(profiling.make_token())))
+
+    def test_invalid_token(self):
+        self.assertFalse(profiling.is_valid_token('profile:forged:signature'))
+        self.assertFalse(profiling.should_profile(self.request('profile:forged:signature')))
+
+    def test_expired_token(self):
+        with mock.patch('time.time', return_value=time.time() - 120):
+            token = profiling.make_token()
+        self.assertFalse(profiling.is_valid_token(token))
+
+    def test_no_sampling(self):
+        self.assertFalse(profiling.should_profile(self.request()))
+        self.assertIsNone(self.profile())
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_full_sampling(self):
+        response = self.profile()
+        profile = profiling.get_profile(int(response['X-Profile-Id']))
+        self.assertEqual(profile['path'], '/stops.json')
+        self.assertEqual(profile['status'], 200)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_admin_not_sampled(self):
+        self.assertFalse(profiling.should_profile(RequestFactory().get('/admin/profiles/')))
+
+    def test_async_view_not_profiled(self):
+        self.assertIsNone(self.profile(async_view, token=profiling.make_token()))
+
+    def test_ring_buffer_eviction(self):
+        token = profiling.make_token()
+        ids = [int(self.profile(token=token)['X-Profile-Id']) for _ in range(5)]
+        self.assertIsNone(profiling.get_profile(ids[0]))
+        self.assertIsNone(profiling.get_profile(ids[1]))
+        for profile_id in ids[2:]:
+            self.assertEqual(profiling.get_profile(profile_id)['id'], profile_id)
+        self.assertEqual([summary['id'] for summary in profiling.get_profiles()], ids[:1:-1])
+
+
+NICOSIA = ZoneInfo('Europe/Nicosia')
+
+
+@override_settings(**TEST_SETTINGS, GTFS_TIMEZONE='Europe/Nicosia')
+class ScheduleIndexTests(TestCase):
+    """Next departures from an index built out of a small weekday/weekend timetable"""
+
+    @classmethod
+    def setUpTestData(cls):
+        days = {'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'}
+        for service_id, running in (('weekday', days - {'saturday', 'sunday'}), ('weekend', {'saturday', 'sunday'})):
+            Calendar.objects.create(
+                service_id=service_id, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31),
+                content_hash='', **{day: day in running for day in days},
+            )
+        # Monday 2 March 2026 is a holiday run on the weekend timetable
+        CalendarDate.objects.create(service_id='weekday', date=date(2026, 3, 2), exception_type=2, content_hash='')
+        CalendarDate.objects.create(service_id='weekend', date=date(2026, 3, 2), exception_type=1, content_hash='')
+
+        for trip_id, service_id, departure in (
+            ('wd-8', 'weekday', 8 * 3600),
+            ('wd-9', 'weekday', 9 * 3600),
+            ('wd-late', 'weekday', 25 * 3600 + 1800),  # 01:30 the next morning
+            ('we-10', 'weekend', 10 * 3600),
+        ):
+            trip = Trip.objects.create(
+                trip_id=trip_id, route_id='30', service_id=service_id, headsign='Limassol', content_hash=''
+            )
+            StopTime.objects.create(
+                trip=trip, stop_id='S1', stop_sequence=1, departure_time=departure, content_hash=''
+            )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'schedule_index.npz'
+        self.assertEqual(build_schedule_index(path), 4)
+        with np.load(path) as data:
+            self.services = [str(service) for service in data['services']]
+            self.index = ScheduleIndex(data)
+
+    def departures(self, moment, limit=10):
+        return [
+            (departure['trip_id'], departure['time'])
+            for departure in self.index.next_departures('S1', moment, limit)
+        ]
+
+    def services_on(self, day):
+        return {self.services[row] for row in self.index.services_on(day)}
+
+    def test_services_on(self):
+        self.assertEqual(self.services_on(date(2026, 3, 3)), {'weekday'})
+        self.assertEqual(self.services_on(date(2026, 3, 7)), {'weekend'})
+        self.assertEqual(self.services_on(date(2027, 3, 3)), set())
+
+    def test_services_on_calendar_date_exceptions(self):
+        self.assertEqual(self.services_on(date(2026, 3, 2)), {'weekend'})
+
+    def test_next_departures(self):
+        self.assertEqual(self.departures(datetime(2026, 3, 3, 7, 0, tzinfo=NICOSIA), limit=2), [
+            ('wd-8', '2026-03-03T08:00:00+02:00'),
+            ('wd-9', '2026-03-03T09:00:00+02:00'),
+        ])
+
+    def test_departure_at_the_moment_is_included(self):
+        moment = datetime(2026, 3, 3, 8, 0, tzinfo=NICOSIA)
+        self.assertEqual(self.departures(moment, limit=1), [('wd-8', '2026-03-03T08:00:00+02:00')])
+
+    def test_moment_in_another_timezone(self):
+        moment = datetime(2026, 3, 3, 6, 30, tzinfo=ZoneInfo('UTC'))  # 08:30 in Nicosia
+        self.assertEqual(self.departures(moment, limit=1), [('wd-9', '2026-03-03T09:00:00+02:00')])
+
+    def test_previous_service_day_past_midnight(self):
+        # Tuesday's 25:30 trip leaves at 01:30 on Wednesday, before Wednesday's own trips
+        self.assertEqual(self.departures(datetime(2026, 3, 4, 0, 30, tzinfo=NICOSIA), limit=2), [
+            ('wd-late', '2026-03-04T01:30:00+02:00'),
+            ('wd-8', '2026-03-04T08:00:00+02:00'),
+        ])
+
+    def test_previous_service_day_into_weekend(self):
+        self.assertEqual(self.departures(datetime(2026, 3, 7, 0, 30, tzinfo=NICOSIA)), [
+            ('wd-late', '2026-03-07T01:30:00+02:00'),
+            ('we-10', '2026-03-07T10:00:00+02:00'),
+        ])
+
+    def test_holiday_runs_the_added_service(self):
+        self.assertEqual(self.departures(datetime(2026, 3, 2, 7, 0, tzinfo=NICOSIA)), [
+            ('we-10', '2026-03-02T10:00:00+02:00'),
+        ])
+
+    def test_removed_service_has_no_late_trips_next_morning(self):
+        # Monday's weekday service is removed, so no 25:30 trip runs early on Tuesday
+        self.assertEqual(self.departures(datetime(2026, 3, 3, 0, 30, tzinfo=NICOSIA), limit=1), [
+            ('wd-8', '2026-03-03T08:00:00+02:00'),
+        ])
+
+    def test_unknown_stop(self):
+        self.assertEqual(self.index.next_departures('S2', datetime(2026, 3, 3, 7, 0, tzinfo=NICOSIA), 10), [])
+
+
+def vehicle(vehicle_id, **fields):
+    return {
+        'vehicle_id': vehicle_id, 'lat': 35.0, 'lon': 33.0, 'matched_lat': None, 'matched_lon': None,
+        'bearing': 90.0, 'speed': 30.0, 'route': '30', 'current_stop_sequence': 4, 'current_status': 2,
+        **fields,
+    }
+
+
+@override_settings(**TEST_SETTINGS, GTFS_RT_DELTA_WINDOW=120)
+class SnapshotDeltaTests(SimpleTestCase):
+    """Deltas between stored snapshot versions"""
+
+    def setUp(self):
+        cache.clear()
+
+    def store(self, vehicles, age=0):
+        snapshot = {'fetched_at': time.time() - age, 'feed_timestamp': 0, 'vehicles': vehicles, 'content': b''}
+        feed_cache.store_snapshot(snapshot)
+        return snapshot
+
+    def test_versions_increase(self):
+        first = self.store([vehicle('a')])
+        second = self.store([vehicle('a')])
+        self.assertGreater(second['version'], first['version'])
+
+    def test_delta(self):
+        first = self.store([vehicle('a'), vehicle('b'), vehicle('c')])
+        moved = vehicle('b', lat=35.001)
+        snapped = vehicle('c', matched_lat=35.0, matched_lon=33.0)
+        added = vehicle('d')
+        second = self.store([vehicle('a'), moved, snapped, added])
+        self.assertEqual(feed_cache.delta_since(second, first['version']), {
+            'vehicles': [moved, snapped, added],
+            'removed': [],
+        })
+
+    def test_delta_removed(self):
+        first = self.store([vehicle('a'), vehicle('b')])
+        second = self.store([vehicle('a')])
+        self.assertEqual(feed_cache.delta_since(second, first['version']), {'vehicles': [], 'removed': ['b']})
+
+    def test_delta_to_same_version_is_empty(self):
+        snapshot = self.store([vehicle('a')])
+        self.assertEqual(feed_cache.delta_since(snapshot, snapshot['version']), {'vehicles': [], 'removed': []})
+
+    def test_unknown_or_future_version(self):
+        snapshot = self.store([vehicle('a')])
+        self.assertIsNone(feed_cache.delta_since(snapshot, snapshot['version'] + 1))
+        self.assertIsNone(feed_cache.delta_since(snapshot, snapshot['version'] - 1000))
+
+    def test_version_outside_window(self):
+        first = self.store([vehicle('a')], age=300)
+        second = self.store([vehicle('a', lat=35.001)])
+        self.assertIsNone(feed_cache.delta_since(second, first['version']))
+
+    def test_payload(self):
+        first = self.store([vehicle('a'), vehicle('b')])
+        second = self.store([vehicle('a'), vehicle('b', speed=0.0)])
+
+        payload = feed_cache.snapshot_payload(second, first['version'])
+        self.assertFalse(payload['full'])
+        self.assertEqual(payload['since'], first['version'])
+        self.assertEqual(payload['vehicles'], [vehicle('b', speed=0.0)])
+
+        payload = feed_cache.snapshot_payload(second)
+        self.assertTrue(payload['full'])
+        self.assertEqual(payload['vehicles'], second['vehicles'])
+
+        payload = feed_cache.snapshot_payload(second, second['version'] + 1)
+        self.assertTrue(payload['full'])
+
+
+ROUTE_LAT = 35.0
+
+
+def route_lon(metres):
+    """Longitude `metres` east of 33.0 along the test route's parallel"""
+    return 33.0 + math.degrees(metres / (EARTH_RADIUS * math.cos(math.radians(ROUTE_LAT))))
+
+
+@override_settings(MAP_MATCH_MAX_DISTANCE=50, MAP_MATCH_STOPPED_DISTANCE=20, MAP_MATCH_INCOMING_DISTANCE=150)
+class MapMatchingTests(SimpleTestCase):
+    """Snapping vehicles onto a straight ~900 m route with stops at 0, 400 and 850 m"""
+
+    def setUp(self):
+        line = RouteLine(
+            [(route_lon(0), ROUTE_LAT), (route_lon(900), ROUTE_LAT)],
+            [('A', 1, 0.0), ('B', 2, 400.0), ('C', 3, 850.0)],
+        )
+        patcher = mock.patch('transit.map_matching.route_network', return_value=RouteNetwork({'30': line}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def vehicle(self, along, off=0.0, route_id='30'):
+        return RealtimeVehicle(
+            vehicle_id='v', route_id=route_id, longitude=route_lon(along),
+            latitude=ROUTE_LAT + math.degrees(off / EARTH_RADIUS),
+            current_status='IN_TRANSIT', current_stop_sequence=7,
+        )
+
+    def match(self, vehicle):
+        self.assertEqual(match_vehicles([vehicle]), 1 if vehicle.route_id == '30' else 0)
+        return vehicle
+
+    def test_keeps_raw_fix_and_stores_snapped_point(self):
+        vehicle = self.vehicle(100, off=10)
+        raw = (vehicle.latitude, vehicle.longitude)
+        self.match(vehicle)
+        self.assertEqual((vehicle.latitude, vehicle.longitude), raw)
+        self.assertAlmostEqual(vehicle.matched_latitude, ROUTE_LAT, places=6)
+        self.assertAlmostEqual(vehicle.matched_longitude, route_lon(100), places=6)
+        self.assertAlmostEqual(vehicle.distance_along, 100, delta=0.5)
+
+    def test_in_transit(self):
+        vehicle = self.match(self.vehicle(100))
+        self.assertEqual((vehicle.current_status, vehicle.current_stop_sequence), ('IN_TRANSIT', 2))
+
+    def test_incoming(self):
+        vehicle = self.match(self.vehicle(300))
+        self.assertEqual((vehicle.current_status, vehicle.current_stop_sequence), ('INCOMING_AT', 2))
+
+    def test_stopped(self):
+        vehicle = self.match(self.vehicle(410))
+        self.assertEqual((vehicle.current_status, vehicle.current_stop_sequence), ('STOPPED_AT', 2))
+
+    def test_past_last_stop(self):
+        vehicle = self.match(self.vehicle(890))
+        self.assertEqual((vehicle.current_status, vehicle.current_stop_sequence), ('IN_TRANSIT', 7))
+
+    def test_off_route_is_unmatched(self):
+        vehicle = self.vehicle(100, off=100)
+        self.assertEqual(match_vehicles([vehicle]), 0)
+        self.assertIsNone(vehicle.distance_along)
+        self.assertIsNone(vehicle.matched_latitude)
+        self.assertEqual((vehicle.current_status, vehicle.current_stop_sequence), ('IN_TRANSIT', 7))
+
+    def test_unknown_route_is_unmatched(self):
+        vehicle = self.match(self.vehicle(100, route_id='99'))
+        self.assertIsNone(vehicle.distance_along)
+        self.assertIsNone(vehicle.matched_longitude)
+
+
+def decode_binary(content):
+    """Header, records and strings of a binary positions document"""
+    header = wire_formats.BINARY_HEADER.unpack_from(content)
+    count, removed_count = header[-2:]
+    offset = wire_formats.BINARY_HEADER.size
+    records = np.frombuffer(content, dtype=wire_formats.BINARY_RECORD, count=count, offset=offset)
+    offset += records.nbytes
+    strings = []
+    while offset < len(content):
+        (length,) = struct.unpack_from('<H', content, offset)
+        strings.append(content[offset + 2:offset + 2 + length].decode())
+        offset += 2 + length
+    return header, records, strings
+
+
+class WireFormatTests(SimpleTestCase):
+    def negotiate(self, accept=None, **params):
+        headers = {'HTTP_ACCEPT': accept} if accept is not None else {}
+        return wire_formats.negotiate(RequestFactory().get('/realtime/positions/', params, **headers))
+
+    def test_negotiate(self):
+        self.assertEqual(self.negotiate(), 'json')
+        self.assertEqual(self.negotiate('*/*'), 'json')
+        self.assertEqual(self.negotiate('application/x-protobuf'), 'protobuf')
+        self.assertEqual(
+            self.negotiate('application/vnd.transit.vehicles, application/json;q=0.5'), 'binary'
+        )
+        self.assertEqual(
+            self.negotiate('application/vnd.transit.vehicles;q=0.2, application/json;q=0.5'), 'json'
+        )
+        self.assertIsNone(self.negotiate('text/html'))
+
+    def test_negotiate_format_parameter(self):
+        self.assertEqual(self.negotiate('application/json', format='columnar'), 'columnar')
+        self.assertIsNone(self.negotiate(format='xml'))
+
+    def test_columnar(self):
+        payload = {'version': 3, 'full': True, 'vehicles': [vehicle('a'), vehicle('b', speed=12.5)]}
+        document = json.loads(wire_formats.encode_columnar(payload))
+        self.assertEqual(document['vehicles']['vehicle_id'], ['a', 'b'])
+        self.assertEqual(document['vehicles']['speed'], [30.0, 12.5])
+        self.assertEqual(set(document['vehicles']), set(wire_formats.COLUMNS))
+
+    def test_binary(self):
+        payload = {
+            'version': 7,
+            'full': False,
+            'since': 5,
+            'vehicles': [
+                vehicle('a', lat=35.1234567, lon=33.7654321, matched_lat=35.1234, matched_lon=33.7654),
+                vehicle('b', speed=-3.0, bearing=None, current_stop_sequence=None, current_status=None),
+            ],
+            'removed': ['c'],
+        }
+        header, records, strings = decode_binary(wire_formats.encode_binary(payload, 1000.0))
+
+        self.assertEqual(header, (b'TRV2', 0, 7, 5, 1000.0, 2, 1))
+        self.assertEqual(strings, ['a', '30', 'b', '30', 'c'])
+        a, b = records
+        self.assertEqual((a['lat'], a['lon']), (351234567, 337654321))
+        self.assertEqual((a['matched_lat'], a['matched_lon']), (351234000, 337654000))
+        self.assertEqual(a['flags'] & wire_formats.RECORD_MATCHED, wire_formats.RECORD_MATCHED)
+        self.assertEqual((a['bearing'], a['speed']), (9000, 3000))
+        self.assertEqual((a['current_stop_sequence'], a['current_status']), (4, 2))
+
+        self.assertEqual(b['flags'] & wire_formats.RECORD_MATCHED, 0)
+        self.assertEqual((b['matched_lat'], b['matched_lon']), (0, 0))
+        self.assertEqual((b['bearing'], b['speed']), (0, 0))
+        self.assertEqual(b['current_stop_sequence'], wire_formats.UNKNOWN_SEQUENCE)
+        self.assertEqual(b['current_status'], wire_formats.UNKNOWN_STATUS)
+
+    def test_binary_full(self):
+        payload = {'version': 7, 'full': True, 'vehicles': []}
+        header, records, strings = decode_binary(wire_formats.encode_binary(payload, 0.0))
+        self.assertEqual(header, (b'TRV2', 1, 7, 0, 0.0, 0, 0))
+        self.assertEqual((len(records), strings), (0, []))
+
+
+def trip_update_feed(*trips):
+    """A FeedMessage of TripUpdates; each trip is (trip_id, [(stop_id, sequence, departure, arrival)])"""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    for trip_id, stop_times in trips:
+        entity = feed.entity.add(id=trip_id)
+        update = entity.trip_update
+        update.trip.trip_id = trip_id
+        update.trip.route_id = '30'
+        update.vehicle.id = f'bus-{trip_id}'
+        for stop_id, sequence, departure, arrival in stop_times:
+            stop_time = update.stop_time_update.add(stop_id=stop_id, stop_sequence=sequence)
+            if departure:
+                stop_time.departure.time = departure
+                stop_time.departure.delay = 60
+            if arrival:
+                stop_time.arrival.time = arrival
+    return feed
+
+
+@override_settings(**TEST_SETTINGS)
+class DeparturesTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_departures_from_feed(self):
+        feed = trip_update_feed(
+            ('t1', [('S1', 1, 1200, 0), ('S2', 2, 1300, 0), ('S3', 3, 0, 1400)]),
+            ('t2', [('S1', 1, 1100, 0)]),
+        )
+        by_stop = departures.departures_from_feed(feed)
+        self.assertEqual([d['trip_id'] for d in by_stop['S1']], ['t2', 't1'])
+        self.assertEqual(by_stop['S2'], [{
+            'time': 1300, 'delay': 60, 'route_id': '30', 'trip_id': 't1', 'vehicle_id': 'bus-t1',
+            'stop_sequence': 2,
+        }])
+        # The last stop only has an arrival, which stands in for the departure
+        self.assertEqual((by_stop['S3'][0]['time'], by_stop['S3'][0]['delay']), (1400, None))
+
+    def test_skipped_and_untimed_stops(self):
+        feed = trip_update_feed(('t1', [('S1', 1, 1200, 0), ('S2', 2, 0, 0)]))
+        feed.entity[0].trip_update.stop_time_update[0].schedule_relationship = (
+            gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SKIPPED
+        )
+        self.assertEqual(departures.departures_from_feed(feed), {})
+
+    def test_next_departures(self):
+        feed = trip_update_feed(*((f't{i}', [('S1', 1, 1000 + i * 100, 0)]) for i in range(5)))
+        self.assertEqual(departures.publish(feed, generated_at=900.0), 1)
+
+        upcoming, generated_at = departures.next_departures('S1', 1150, 2)
+        self.assertEqual([d['trip_id'] for d in upcoming], ['t2', 't3'])
+        self.assertEqual(generated_at, 900.0)
+        self.assertEqual(departures.next_departures('S1', 1200, 10)[0][0]['trip_id'], 't2')
+        self.assertEqual(departures.next_departures('S2', 0, 10), ([], None))
+
+    def test_publish_clears_emptied_boards(self):
+        departures.publish(trip_update_feed(('t1', [('S1', 1, 1000, 0), ('S2', 2, 1100, 0)])))
+        departures.publish(trip_update_feed(('t2', [('S2', 1, 1200, 0)])))
+        self.assertEqual(departures.next_departures('S1', 0, 10), ([], None))
+        self.assertEqual([d['trip_id'] for d in departures.next_departures('S2', 0, 10)[0]], ['t2'])
@@ -0,0 +1,64 @@
+"""
+Mapbox Vector Tiles for stops and routes, rendered by PostGIS.
+
+Each tile is one ST_AsMVT query bounded by the tile envelope, so the work
+per request depends on what is inside the tile rather than on the size of
+the network. Rendered tiles are cached per z/x/y at the current network
+version, so re-imports invalidate them.
+"""
+from django.conf import settings
+from django.db import connection
+
+from . import network_cache, simplification
+
+MAX_ZOOM = 22
+
+TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS tile,
+           ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s), 4326) AS wgs84
+),
+stops AS (
+    SELECT s.code, s.description, s.description_en, s.description_el,
+           ST_AsMVTGeom(ST_Transform(s.location, 3857), bounds.tile) AS geom
+    FROM transit_stop s, bounds
+    WHERE %(z)s >= %(stops_min_zoom)s AND s.location && bounds.wgs84
+),
+routes AS (
+    SELECT r.route_id, r.line_name, r.route_name, r.direction, r.color,
+           ST_AsMVTGeom(ST_Transform(COALESCE(sg.geometry, r.geometry), 3857), bounds.tile) AS geom
+    FROM bounds, transit_route r
+    LEFT JOIN transit_simplifiedroutegeometry sg
+        ON sg.route_id = r.id AND sg.tolerance = %(tolerance)s
+    WHERE r.geometry && bounds.wgs84
+)
+SELECT COALESCE((SELECT ST_AsMVT(routes, 'routes', 4096, 'geom') FROM routes), ''::bytea)
+    || COALESCE((SELECT ST_AsMVT(stops, 'stops', 4096, 'geom') FROM stops), ''::bytea)
+"""
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def render_tile(z, x, y):
+    """Render the stops and routes layers of one tile"""
+    with connection.cursor() as cursor:
+        cursor.execute(TILE_SQL, {
+            'z': z,
+            'x': x,
+            'y': y,
+            'stops_min_zoom': settings.TILE_STOPS_MIN_ZOOM,
+            # -1 matches no simplified level, i.e. full geometry
+            'tolerance': simplification.tolerance_for_zoom(z) or -1,
+        })
+        return bytes(cursor.fetchone()[0])
+
+
+def tile_document(z, x, y):
+    """The encoded tile for the current network version"""
+    return network_cache.get_or_build(
+        f'tile:{z}/{x}/{y}',
+        lambda: network_cache.encode_document(render_tile(z, x, y)),
+        timeout=settings.TILE_CACHE_TIMEOUT,
+    )
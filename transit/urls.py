@@ -1,12 +1,21 @@
 from django.urls import path
-from .views import MapView, realtime_positions, get_stops_json, routes_geojson
+from .views import (
+    MapView, realtime_positions, realtime_stream, get_stops_json, stops_nearby, stop_arrivals,
+    stop_departures, stop_schedule, routes_geojson, vector_tile, metrics_view,
+)
 
 app_name = 'transit'
 
 urlpatterns = [
     path('realtime/positions/', realtime_positions, name='realtime-positions'),
+    path('realtime/stream/', realtime_stream, name='realtime-stream'),
     path('', MapView.as_view(), name='map'),
     path('stops.json', get_stops_json, name='stops-json'),
+    path('stops/nearby/', stops_nearby, name='stops-nearby'),
+    path('stops/<str:code>/arrivals/', stop_arrivals, name='stop-arrivals'),
+    path('stops/<str:code>/departures/', stop_departures, name='stop-departures'),
+    path('stops/<str:code>/schedule/', stop_schedule, name='stop-schedule'),
     path('routes.geojson', routes_geojson, name='routes-geojson'),
-    path('rt-data/', views.rt_data_view, name='rt-data'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', vector_tile, name='vector-tile'),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
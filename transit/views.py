@@ -1,17 +1,35 @@
-from django.http import JsonResponse
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.gis.db.models.functions import Distance, GeometryDistance
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView
 from .models import Stop, Route, RouteStop, RealtimeVehicle
-from django.utils import timezone
-from datetime import timedelta
-import requests
-from google.transit import gtfs_realtime_pb2
 from django.core.serializers import serialize
 import json
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+from zoneinfo import ZoneInfo
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from . import (
+    departures, eta, feed_cache, geojson, metrics, network_cache, profiling, push, schedule_index,
+    simplification, tiles, wire_formats,
+)
+from .functions import X, Y
 
 # Create your views here.
 
+@method_decorator(metrics.instrument_view(name='map'), name='dispatch')
 class MapView(TemplateView):
     """Main view for displaying the transit map."""
     template_name = 'transit/map.html'
@@ -20,105 +38,352 @@ class MapView(TemplateView):
         context = super().get_context_data(**kwargs)
         return context
 
+@metrics.instrument_view
 def realtime_positions(request):
-    """Fetch and return realtime vehicle positions from GTFS-RT feed."""
-    try:
-        response = requests.get(
-            settings.GTFS_RT_URL,
-            timeout=settings.GTFS_RT_TIMEOUT
+    """Return realtime vehicle positions from the shared GTFS-RT snapshot.
+
+    With ``?since=<version>`` only vehicles added, moved or removed since that
+    version are returned, falling back to the full snapshot when the version
+    is too old. Compact encodings are negotiated through the Accept header or
+    ``?format=`` (see transit.wire_formats).
+    """
+    fmt = wire_formats.negotiate(request)
+    if fmt is None:
+        return JsonResponse(
+            {'error': 'Supported formats: ' + ', '.join(wire_formats.CONTENT_TYPES.values())},
+            status=406
         )
-        response.raise_for_status()
-        
-        feed = gtfs_realtime_pb2.FeedMessage()
-        feed.ParseFromString(response.content)
-        
-        vehicles = []
-        for entity in feed.entity:
-            if entity.HasField('vehicle'):
-                v = entity.vehicle
-                current_stop_sequence = v.current_stop_sequence if v.HasField('current_stop_sequence') else None
-                current_status = v.current_status if v.HasField('current_status') else None
-                
-                vehicles.append({
-                    'vehicle_id': v.vehicle.id,
-                    'lat': v.position.latitude,
-                    'lon': v.position.longitude,
-                    'bearing': v.position.bearing,
-                    'speed': (v.position.speed * 3.6) if v.position.speed else 0,
-                    'route': v.trip.route_id,
-                    'current_stop_sequence': current_stop_sequence,
-                    'current_status': current_status,
-                    'updated': timezone.now().isoformat()
-                })
-        
-        return JsonResponse({
-            'vehicles': vehicles,
-            'expires': (timezone.now() + timedelta(seconds=15)).isoformat()
-        })
-    
+
+    since = request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({'error': 'since must be an integer version'}, status=400)
+
+    try:
+        snapshot = feed_cache.get_snapshot()
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+    if fmt == 'json':
+        payload = feed_cache.snapshot_payload(snapshot, since)
+        with metrics.SERIALIZE_SECONDS.labels(document='positions.json').time():
+            response = JsonResponse(payload)
+    else:
+        response = HttpResponse(
+            wire_formats.encoded_payload(snapshot, since, fmt),
+            content_type=wire_formats.CONTENT_TYPES[fmt]
+        )
+        response['X-Snapshot-Version'] = snapshot['version']
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+def _parse_finite(value):
+    """Parse a float query value, rejecting nan and infinities"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'{value} is not a finite number')
+    return number
+
+def _parse_bbox(value):
+    """Parse a ``minLon,minLat,maxLon,maxLat`` query value"""
+    min_lon, min_lat, max_lon, max_lat = (_parse_finite(part) for part in value.split(','))
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError('bbox minimums must not exceed maximums')
+    return min_lon, min_lat, max_lon, max_lat
+
+@metrics.instrument_view
+async def realtime_stream(request):
+    """Push realtime vehicle positions as Server-Sent Events.
+
+    Accepts optional ``route`` (repeatable) and ``bbox`` filters. Each event
+    carries the same document as ``realtime_positions``: a full snapshot
+    first, then deltas as new versions arrive.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Streaming requires the ASGI application'}, status=501)
+
+    try:
+        bbox = _parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+        since = request.headers.get('Last-Event-ID')
+        since = int(since) if since else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    subscription = push.Subscription(
+        routes=request.GET.getlist('route'),
+        bbox=bbox,
+        since=since,
+    )
+    response = StreamingHttpResponse(
+        push.stream_events(subscription),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering events
+    return response
+
+@metrics.instrument_view
 def get_stops_json(request):
-    """Return bus stops as GeoJSON, optionally filtered by route."""
+    """Return bus stops as GeoJSON, optionally filtered by route.
+
+    ``bbox=minLon,minLat,maxLon,maxLat`` limits the result to the viewport.
+    Without a route, ``limit`` pages through stops and the response carries
+    a ``next_cursor`` to pass back as ``cursor`` for the following page.
+    """
     route_id = request.GET.get('route_id')
-    
+    try:
+        bbox = _parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        cursor = int(request.GET['cursor']) if request.GET.get('cursor') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if limit is not None:
+        limit = max(1, min(limit, settings.STOPS_MAX_LIMIT))
+    viewport = Polygon.from_bbox(bbox) if bbox else None
+
+    next_cursor = None
     if route_id:
-        # Get stops for specific route in sequence order
-        route_stops = RouteStop.objects.filter(route__route_id=route_id).select_related('stop').order_by('sequence')
-        stops = [rs.stop for rs in route_stops]
+        # Get stops for specific route in sequence order, in one query
+        stops = RouteStop.objects.filter(route__route_id=route_id).order_by('sequence')
+        if viewport:
+            stops = stops.filter(stop__location__contained=viewport)
+        stops_list = list(stops.values(
+            'sequence',
+            code=F('stop__code'),
+            description=F('stop__description'),
+            description_en=F('stop__description_en'),
+            description_el=F('stop__description_el'),
+            lat=Y('stop__location'),
+            lon=X('stop__location'),
+        ))
     else:
-        # Get all stops if no route specified
-        stops = Stop.objects.all()
-
-    stops_list = [
-        {
-            'code': stop.code,
-            'description': stop.description,
-            'description_en': stop.description_en,
-            'description_el': stop.description_el,
-            'lat': stop.location.y,
-            'lon': stop.location.x,
-            'sequence': next((rs.sequence for rs in stop.routestop_set.filter(route__route_id=route_id)) if route_id else None, None)
-        }
-        for stop in stops
+        # Get all stops if no route specified, paged by primary key
+        stops = Stop.objects.order_by('id')
+        if viewport:
+            # Bounding-box containment is answered from the GiST index
+            stops = stops.filter(location__contained=viewport)
+        if cursor is not None:
+            stops = stops.filter(id__gt=cursor)
+        stops = stops.annotate(lat=Y('location'), lon=X('location')).values(
+            'id', 'code', 'description', 'description_en', 'description_el', 'lat', 'lon'
+        )
+        if limit is not None:
+            stops = stops[:limit]
+        stops_list = list(stops)
+        if limit is not None and len(stops_list) == limit:
+            next_cursor = stops_list[-1]['id']
+        for stop in stops_list:
+            del stop['id']
+            stop['sequence'] = None
+
+    response = {'stops': stops_list}
+    if limit is not None and not route_id:
+        response['next_cursor'] = next_cursor
+    return JsonResponse(response)
+
+@metrics.instrument_view
+def stops_nearby(request):
+    """Return the stops nearest to ``lat``/``lon`` with the routes serving them.
+
+    Takes ``k`` (number of stops) and ``radius`` (metres). Candidates come
+    from an index-assisted KNN scan (``<->``) and are then ranked by true
+    distance, so the whole lookup is two queries.
+    """
+    try:
+        lat = _parse_finite(request.GET['lat'])
+        lon = _parse_finite(request.GET['lon'])
+        k = int(request.GET.get('k') or settings.NEARBY_STOPS_DEFAULT_K)
+        radius = _parse_finite(request.GET.get('radius') or settings.NEARBY_STOPS_DEFAULT_RADIUS)
+    except KeyError as e:
+        return JsonResponse({'error': f'{e.args[0]} is required'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({'error': 'lat must be within ±90 and lon within ±180'}, status=400)
+    k = max(1, min(k, settings.NEARBY_STOPS_MAX_K))
+    radius = max(0, min(radius, settings.NEARBY_STOPS_MAX_RADIUS))
+    origin = Point(lon, lat, srid=4326)
+
+    # Planar <-> order in degrees differs slightly from metric order away
+    # from the equator, so over-fetch candidates before ranking by distance
+    candidates = Stop.objects.order_by(GeometryDistance('location', origin)).values('id')[:k * 3]
+    stops = list(
+        Stop.objects.filter(id__in=candidates)
+        .annotate(distance=Distance('location', origin), lat=Y('location'), lon=X('location'))
+        .filter(distance__lte=D(m=radius))
+        .order_by('distance')
+        .values('id', 'code', 'description', 'description_en', 'description_el', 'lat', 'lon', 'distance')[:k]
+    )
+
+    routes_by_stop = {}
+    route_stops = RouteStop.objects.filter(stop_id__in=[stop['id'] for stop in stops]).order_by(
+        'route__route_id'
+    ).values(
+        'stop_id', 'sequence', 'route__route_id', 'route__line_name', 'route__route_name', 'route__color'
+    )
+    for rs in route_stops:
+        routes_by_stop.setdefault(rs['stop_id'], []).append({
+            'route_id': rs['route__route_id'],
+            'line_name': rs['route__line_name'],
+            'route_name': rs['route__route_name'],
+            'color': rs['route__color'],
+            'sequence': rs['sequence'],
+        })
+
+    for stop in stops:
+        stop['distance'] = round(stop['distance'].m, 1)
+        stop['routes'] = routes_by_stop.get(stop.pop('id'), [])
+    return JsonResponse({'stops': stops})
+
+@metrics.instrument_view
+def stop_arrivals(request, code):
+    """Return estimated arrivals at a stop, soonest first.
+
+    Estimates are computed by the realtime ingestion daemon each cycle and
+    read here from the cache; ``seconds`` is relative to this response.
+    """
+    board = eta.stop_arrivals(code)
+    if board is None:
+        if not Stop.objects.filter(code=code).exists():
+            raise Http404('Stop not found')
+        board = {'generated_at': None, 'arrivals': []}
+
+    now = time.time()
+    arrivals = [
+        {**arrival, 'seconds': max(0, round(arrival['arrival_time'] - now))}
+        for arrival in board['arrivals']
+        if arrival['arrival_time'] >= now - settings.GTFS_RT_REFRESH_INTERVAL
     ]
-    return JsonResponse({'stops': stops_list})
+    return JsonResponse({'stop': code, 'generated_at': board['generated_at'], 'arrivals': arrivals})
+
+@metrics.instrument_view
+def stop_departures(request, code):
+    """Return predicted departures at a stop from the realtime TripUpdates.
+
+    Takes ``limit`` and ``after`` (epoch seconds, default now). Served from
+    the per-stop board cached at ingestion; no database access.
+    """
+    try:
+        limit = int(request.GET.get('limit') or settings.DEPARTURES_DEFAULT_LIMIT)
+        after = int(request.GET['after']) if request.GET.get('after') else int(time.time())
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    limit = max(1, min(limit, settings.DEPARTURES_MAX_LIMIT))
+
+    upcoming, generated_at = departures.next_departures(code, after, limit)
+    return JsonResponse({'stop': code, 'generated_at': generated_at, 'departures': upcoming})
+
+@metrics.instrument_view
+def stop_schedule(request, code):
+    """Return the next scheduled departures at a stop from the static timetable.
+
+    Takes ``limit`` and ``at`` (ISO datetime, default now). Answered from the
+    precomputed schedule index without touching the database.
+    """
+    index = schedule_index.get_index()
+    if index is None:
+        return JsonResponse({'error': 'Schedule index has not been built'}, status=503)
+
+    try:
+        limit = int(request.GET.get('limit') or settings.SCHEDULE_DEFAULT_LIMIT)
+        at = datetime.fromisoformat(request.GET['at']) if request.GET.get('at') else timezone.now()
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if timezone.is_naive(at):
+        at = at.replace(tzinfo=ZoneInfo(settings.GTFS_TIMEZONE))
+    limit = max(1, min(limit, settings.SCHEDULE_MAX_LIMIT))
+
+    return JsonResponse({'stop': code, 'departures': index.next_departures(code, at, limit)})
 
+@metrics.instrument_view
 def routes_geojson(request):
-    """Return all routes as GeoJSON."""
-    routes = Route.objects.prefetch_related('routestop_set__stop').all()
-    features = []
-    
-    for route in routes:
-        # Get stops in sequence
-        route_stops = route.routestop_set.all().order_by('sequence')
-        stops_data = [{
-            'code': rs.stop.code,
-            'description': rs.stop.description,
-            'description_en': rs.stop.description_en,
-            'description_el': rs.stop.description_el,
-            'sequence': rs.sequence,
-            'location': [rs.stop.location.x, rs.stop.location.y]
-        } for rs in route_stops]
-        
-        feature = {
-            'type': 'Feature',
-            'geometry': json.loads(route.geometry.json),
-            'properties': {
-                'route_id': route.route_id,
-                'name': route.name,
-                'description': route.description,
-                'line_name': route.line_name,
-                'route_name': route.route_name,
-                'direction': route.direction,
-                'color': route.color,
-                'stops': stops_data
-            }
-        }
-        features.append(feature)
-    
-    return JsonResponse({
-        'type': 'FeatureCollection',
-        'features': features
+    """Return all routes as GeoJSON, prebuilt and compressed per network version.
+
+    ``?zoom=`` picks the simplified geometries that look identical at that
+    map zoom; ``?tolerance=`` (degrees) picks a level directly.
+    """
+    try:
+        if request.GET.get('zoom'):
+            tolerance = simplification.tolerance_for_zoom(_parse_finite(request.GET['zoom']))
+        elif request.GET.get('tolerance'):
+            tolerance = simplification.nearest_tolerance(_parse_finite(request.GET['tolerance']))
+        else:
+            tolerance = None
+    except ValueError:
+        return JsonResponse({'error': 'zoom and tolerance must be finite numbers'}, status=400)
+
+    return network_cache.document_response(
+        request, geojson.routes_document(tolerance), 'application/json'
+    )
+
+@metrics.instrument_view
+def vector_tile(request, z, x, y):
+    """Return stops and routes as a Mapbox Vector Tile."""
+    if not tiles.is_valid_tile(z, x, y):
+        raise Http404('Tile out of range')
+    return network_cache.document_response(
+        request, tiles.tile_document(z, x, y), 'application/vnd.mapbox-vector-tile'
+    )
+
+def _may_scrape(request):
+    """Scrapers are let in by address, or with METRICS_TOKEN as a bearer token"""
+    if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+    token = settings.METRICS_TOKEN
+    return bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+def metrics_view(request):
+    """Expose metrics from every worker in the Prometheus text format."""
+    if not _may_scrape(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    snapshot = cache.get(feed_cache.SNAPSHOT_KEY)
+    if snapshot is not None and snapshot['feed_timestamp']:
+        metrics.FEED_AGE.set(time.time() - snapshot['feed_timestamp'])
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def _profile_context(profile):
+    return {
+        **profile,
+        'started': datetime.fromtimestamp(profile['started_at'], tz=dt_timezone.utc),
+        'duration_ms': profile['duration'] * 1000,
+        'query_time_ms': profile['query_time'] * 1000,
+    }
+
+@staff_member_required
+def profile_list(request):
+    """List the stored request profiles (see transit.profiling)."""
+    return render(request, 'admin/transit/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': [_profile_context(profile) for profile in profiling.get_profiles()],
+        'max_profiles': settings.PROFILING_MAX_PROFILES,
+        'sample_rate': settings.PROFILING_SAMPLE_RATE,
+        'header': settings.PROFILING_HEADER,
     })
+
+@staff_member_required
+def profile_detail(request, profile_id):
+    """Show one stored profile's report and queries."""
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise Http404('Profile not found')
+    profile = _profile_context(profile)
+    profile['queries'] = [
+        {**query, 'duration_ms': query['duration'] * 1000} for query in profile['queries']
+    ]
+    return render(request, 'admin/transit/profile.html', {
+        **admin.site.each_context(request),
+        'title': f'Profile {profile_id}',
+        'profile': profile,
+    })
+
+@staff_member_required
+def profile_download(request, profile_id):
+    """Download one stored profile's raw stats in the pstats file format."""
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise Http404('Profile not found')
+    response = HttpResponse(profile['stats'], content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="profile-{profile_id}.prof"'
+    return response
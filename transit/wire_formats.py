@@ -0,0 +1,169 @@
+"""
+Compact encodings of the realtime positions document.
+
+The default JSON document repeats every key for every vehicle. Clients that
+ask for it (``Accept`` header or ``?format=``) get one of:
+
+``columnar``
+    JSON with one array per field instead of one object per vehicle.
+``protobuf``
+    The upstream GTFS-RT FeedMessage bytes, passed through unchanged. Always
+    a full snapshot and not map matched; the version is in the
+    ``X-Snapshot-Version`` header.
+``binary``
+    A quantised fixed-width layout, little-endian::
+
+        header   magic "TRV2", flags u8 (bit 0: full), version i64,
+                 since i64 (0 when full), expires f64 (epoch seconds),
+                 vehicle count u32, removed count u32
+        records  per vehicle: lat i32 and lon i32 (raw GPS fix, 1e-7 degrees),
+                 matched_lat i32 and matched_lon i32 (point snapped to the
+                 route, 1e-7 degrees; 0 when unmatched), bearing u16
+                 (0.01 degrees), speed u16 (0.01 km/h),
+                 current_stop_sequence u32, current_status u8
+                 (0xffffffff / 0xff when unknown), flags u8 (bit 0: matched)
+        strings  per vehicle: vehicle_id then route, then each removed
+                 vehicle_id; each a u16 byte length followed by UTF-8
+
+Encoded documents are cached per version, so each is built once however
+many clients ask for it.
+"""
+import json
+import struct
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import feed_cache, metrics
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.transit.columnar+json',
+    'protobuf': 'application/x-protobuf',
+    'binary': 'application/vnd.transit.vehicles',
+}
+
+# Fields carried per vehicle by the compact formats; ``updated`` is the
+# same for every vehicle and is sent once per document instead
+COLUMNS = ('vehicle_id', 'lat', 'lon', 'matched_lat', 'matched_lon', 'bearing', 'speed', 'route', 'current_stop_sequence', 'current_status')
+
+BINARY_MAGIC = b'TRV2'
+BINARY_HEADER = struct.Struct('<4sBqqdII')
+BINARY_RECORD = np.dtype([
+    ('lat', '<i4'),
+    ('lon', '<i4'),
+    ('matched_lat', '<i4'),
+    ('matched_lon', '<i4'),
+    ('bearing', '<u2'),
+    ('speed', '<u2'),
+    ('current_stop_sequence', '<u4'),
+    ('current_status', 'u1'),
+    ('flags', 'u1'),
+])
+UNKNOWN_SEQUENCE = 0xffffffff
+UNKNOWN_STATUS = 0xff
+RECORD_MATCHED = 0x01
+
+
+def negotiate(request):
+    """Pick a format from ``?format=`` or the Accept header; None if unacceptable"""
+    requested = request.GET.get('format')
+    if requested:
+        return requested if requested in CONTENT_TYPES else None
+
+    accept = request.headers.get('Accept', '')
+    if not accept.strip():
+        return 'json'
+    best, best_quality = None, 0.0
+    for part in accept.split(','):
+        media_type, _, params = part.partition(';')
+        media_type = media_type.strip().lower()
+        name, _, value = params.partition('=')
+        try:
+            quality = float(value) if name.strip() == 'q' else 1.0
+        except ValueError:
+            quality = 0.0
+        if media_type in ('*/*', 'application/*'):
+            fmt = 'json'
+        else:
+            fmt = next((f for f, content_type in CONTENT_TYPES.items() if content_type == media_type), None)
+        if fmt is not None and quality > best_quality:
+            best, best_quality = fmt, quality
+    return best
+
+
+def encoded_payload(snapshot, since, fmt):
+    """The positions document for `snapshot` in a compact format, as bytes"""
+    if fmt == 'protobuf':
+        return snapshot['content']
+
+    key = f"gtfs_rt:encoded:{fmt}:{snapshot['version']}:{since}"
+    content = cache.get(key)
+    if content is None:
+        payload = feed_cache.snapshot_payload(snapshot, since)
+        payload['updated'] = snapshot['fetched_at']
+        with metrics.SERIALIZE_SECONDS.labels(document=f'positions.{fmt}').time():
+            if fmt == 'columnar':
+                content = encode_columnar(payload)
+            else:
+                content = encode_binary(payload, feed_cache.expires_at(snapshot).timestamp())
+        cache.set(key, content, timeout=settings.GTFS_RT_REFRESH_INTERVAL * 2)
+    return content
+
+
+def columns(vehicles):
+    return {name: [vehicle[name] for vehicle in vehicles] for name in COLUMNS}
+
+
+def encode_columnar(payload):
+    document = {**payload, 'vehicles': columns(payload['vehicles'])}
+    return json.dumps(document, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def _quantise(values, scale, unknown, dtype):
+    array = np.array([unknown if value is None else value for value in values], dtype=float)
+    return np.rint(array * scale).astype(dtype)
+
+
+def _encode_strings(strings):
+    parts = []
+    for string in strings:
+        encoded = (string or '').encode()
+        parts.append(struct.pack('<H', len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def encode_binary(payload, expires):
+    vehicles = payload['vehicles']
+    removed = payload.get('removed', [])
+    data = columns(vehicles)
+
+    records = np.empty(len(vehicles), dtype=BINARY_RECORD)
+    records['lat'] = _quantise(data['lat'], 1e7, 0, '<i4')
+    records['lon'] = _quantise(data['lon'], 1e7, 0, '<i4')
+    records['matched_lat'] = _quantise(data['matched_lat'], 1e7, 0, '<i4')
+    records['matched_lon'] = _quantise(data['matched_lon'], 1e7, 0, '<i4')
+    records['bearing'] = _quantise([(b or 0) % 360 for b in data['bearing']], 100, 0, '<u2')
+    records['speed'] = _quantise([min(max(s or 0, 0), 655) for s in data['speed']], 100, 0, '<u2')
+    records['current_stop_sequence'] = _quantise(
+        data['current_stop_sequence'], 1, UNKNOWN_SEQUENCE, '<u4'
+    )
+    records['current_status'] = _quantise(data['current_status'], 1, UNKNOWN_STATUS, 'u1')
+    records['flags'] = [RECORD_MATCHED if lat is not None else 0 for lat in data['matched_lat']]
+
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC,
+        1 if payload['full'] else 0,
+        payload['version'],
+        payload.get('since') or 0,
+        expires,
+        len(vehicles),
+        len(removed),
+    )
+    strings = _encode_strings(
+        [value for pair in zip(data['vehicle_id'], data['route']) for value in pair] + list(removed)
+    )
+    return header + records.tobytes() + strings